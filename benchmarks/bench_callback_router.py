@@ -0,0 +1,100 @@
+import argparse
+import random
+import re
+import time
+
+from bot.callback_data import Action, CallbackRouter, callback_data_limit, encode
+
+legacy_patterns = [
+    re.compile(pattern)
+    for pattern in (
+        "return_to_start_callback",
+        "view_ad",
+        r"ads_page_(next|prev)_\d+",
+        "unpublish_all_ads",
+        "validation_ad",
+        r"approve_ad_\d+",
+        r"disapprove_ad_\d+",
+        r"delete_ad_\d+",
+        "publish_ad_callback",
+    )
+]
+
+
+async def noop(update, context, *ids):
+    return ids
+
+
+def legacy_route(data):
+    for index, pattern in enumerate(legacy_patterns):
+        if pattern.match(data):
+            ids = re.findall(r"\d+", data)
+            return index, int(ids[0]) if ids else None
+    return None
+
+
+def measure(name, function, samples, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for sample in samples:
+            function(sample)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>14}: {elapsed / (iterations * len(samples)) * 1e9:8.0f} нс/колбэк")
+
+
+def main(iterations, max_id):
+    ad_ids = [random.randint(1, max_id) for _ in range(100)]
+    legacy = [
+        data
+        for ad_id in ad_ids
+        for data in (
+            f"approve_ad_{ad_id}",
+            f"disapprove_ad_{ad_id}",
+            f"delete_ad_{ad_id}",
+            f"ads_page_next_{ad_id}",
+            "publish_ad_callback",
+        )
+    ]
+    encoded = [
+        data
+        for ad_id in ad_ids
+        for data in (
+            encode(Action.APPROVE_AD, ad_id),
+            encode(Action.DISAPPROVE_AD, ad_id),
+            encode(Action.UNPUBLISH_AD, ad_id),
+            encode(Action.ADS_NEXT, ad_id),
+            encode(Action.PUBLISH_AD),
+        )
+    ]
+    router = CallbackRouter()
+    for action in Action:
+        router.route(action, noop)
+
+    def decode_and_lookup(data):
+        return router.matches(data)
+
+    print(
+        "Средняя длина callback_data: "
+        f"{sum(map(len, legacy)) / len(legacy):.1f} -> "
+        f"{sum(map(len, encoded)) / len(encoded):.1f} байт "
+        f"(лимит {callback_data_limit})"
+    )
+    measure("regex-цепочка", legacy_route, legacy, iterations)
+    measure("кодек + dict", decode_and_lookup, encoded, iterations)
+    measure("легаси + dict", decode_and_lookup, legacy, iterations)
+    largest = encode(Action.ADS_PREV, 2**63 - 1)
+    print(f"Самый длинный колбэк: {largest!r}, {len(largest.encode())} байт")
+    try:
+        encode(Action.APPROVE_AD, *range(10**6, 10**6 + 20))
+    except ValueError as error:
+        print(f"Проверка лимита: {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Сравнение маршрутизации колбэков: regex-цепочка против кодека"
+    )
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--max-id", type=int, default=10_000_000)
+    arguments = parser.parse_args()
+    main(arguments.iterations, arguments.max_id)
@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import delete, insert, select
+
+from database.db_config import async_session, engine
+from database.entities import Ad, Image, User
+from database.migrations import database_init
+from database.models import CreateAdRequest, CreateUserRequest
+from database.services import create_ad, create_or_update_user, fetch_categories
+
+bench_telegram_id = -1_000_000_001
+
+
+async def multi_statement_create_ad(request: CreateAdRequest):
+    async with async_session() as session:
+        async with session.begin():
+            select_user_result = await session.execute(
+                select(User).where(User.telegram_id == request.user_id)
+            )
+            user = select_user_result.scalar_one()
+            ad: Ad = await session.scalar(
+                insert(Ad).returning(Ad),
+                [
+                    {
+                        "user_id": user.id,
+                        "title": request.title,
+                        "description": request.description,
+                        "cost": int(request.cost),
+                        "category_id": request.category_id,
+                    }
+                ],
+            )
+            if request.image_ids:
+                await session.execute(
+                    insert(Image).values(
+                        [
+                            {
+                                "image_id": image_id,
+                                "media_id": request.media_id,
+                                "ad_id": ad.id,
+                            }
+                            for image_id in request.image_ids
+                        ]
+                    )
+                )
+            return ad.id
+
+
+async def measure(create, request, iterations, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_once():
+        async with semaphore:
+            started = time.perf_counter()
+            await create(request)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_once() for _ in range(iterations)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops/s": iterations / elapsed,
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+async def cleanup():
+    async with async_session() as session:
+        async with session.begin():
+            user_id = await session.scalar(
+                select(User.id).where(User.telegram_id == bench_telegram_id)
+            )
+            ad_ids = select(Ad.id).where(Ad.user_id == user_id)
+            await session.execute(delete(Image).where(Image.ad_id.in_(ad_ids)))
+            await session.execute(delete(Ad).where(Ad.user_id == user_id))
+            await session.execute(delete(User).where(User.id == user_id))
+
+
+async def main(iterations, concurrency, images):
+    await database_init()
+    await create_or_update_user(
+        CreateUserRequest(
+            first_name="Bench",
+            last_name="Bench",
+            telegram_id=bench_telegram_id,
+            telegram_login="bench",
+        )
+    )
+    category = (await fetch_categories())[0]
+    request = CreateAdRequest(
+        user_id=bench_telegram_id,
+        title="Benchmark",
+        description="Benchmark ad",
+        file_id=None,
+        message_id="",
+        cost=1000,
+        category_title=category.title,
+        category_id=category.id,
+        media_id="bench-media-group" if images > 1 else None,
+        image_ids=[f"bench-file-{index}" for index in range(images)],
+    )
+    try:
+        for name, create in (
+            ("multi-statement", multi_statement_create_ad),
+            ("single CTE", create_ad),
+        ):
+            await measure(create, request, min(iterations, 50), concurrency)
+            result = await measure(create, request, iterations, concurrency)
+            print(
+                f"{name:>16}: {result['ops/s']:8.1f} ops/s  "
+                f"mean {result['mean']:6.2f} ms  p50 {result['p50']:6.2f} ms  "
+                f"p95 {result['p95']:6.2f} ms  p99 {result['p99']:6.2f} ms"
+            )
+    finally:
+        await cleanup()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Сравнение задержки create_ad: несколько запросов против CTE"
+    )
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--images", type=int, default=3)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.iterations, arguments.concurrency, arguments.images))
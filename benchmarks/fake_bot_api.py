@@ -0,0 +1,127 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application as WebApplication, RequestHandler
+
+fake_bot_user = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Load",
+    "username": "load_test_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": True,
+}
+message_methods = {
+    "sendMessage",
+    "sendPhoto",
+    "editMessageText",
+    "editMessageCaption",
+    "editMessageReplyMarkup",
+}
+
+
+def decode_parameter(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class FakeBotApiHandler(RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def post(self, method):
+        parameters = {
+            name: decode_parameter(values[-1].decode())
+            for name, values in self.request.body_arguments.items()
+        }
+        if not parameters and self.request.body:
+            parameters = json.loads(self.request.body)
+        self.set_header("Content-Type", "application/json")
+        self.write(await self.api.call(method, parameters))
+
+    get = post
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.05, flood_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.floods = Counter()
+        self.messages = defaultdict(list)
+        self._message_id = 0
+        self._server = None
+
+    def _message(self, chat_id, parameters):
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {
+                "id": chat_id if isinstance(chat_id, int) else -1,
+                "type": (
+                    "private" if isinstance(chat_id, int) and chat_id > 0 else "channel"
+                ),
+            },
+            "from": fake_bot_user,
+        }
+        if "text" in parameters:
+            message["text"] = parameters["text"]
+        self.messages[chat_id].append(parameters)
+        return message
+
+    def result(self, method, parameters):
+        chat_id = parameters.get("chat_id")
+        if method == "getMe":
+            return fake_bot_user
+        if method in message_methods:
+            return self._message(chat_id, parameters)
+        if method == "sendMediaGroup":
+            return [self._message(chat_id, {}) for _ in parameters.get("media") or ()]
+        return True
+
+    async def call(self, method, parameters):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(self.latency / 2, self.latency * 1.5))
+        if method != "getMe" and random.random() < self.flood_rate:
+            self.floods[method] += 1
+            return {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        return {"ok": True, "result": self.result(method, parameters)}
+
+    def callback_data(self, chat_id):
+        for parameters in self.messages[chat_id]:
+            for row in (parameters.get("reply_markup") or {}).get(
+                "inline_keyboard", ()
+            ):
+                for button in row:
+                    if "callback_data" in button:
+                        yield button["callback_data"]
+
+    def start(self, port=0, listen="127.0.0.1"):
+        self._server = HTTPServer(
+            WebApplication([(r"/bot[^/]+/(\w+)", FakeBotApiHandler, {"api": self})])
+        )
+        sockets = bind_sockets(port, listen)
+        self._server.add_sockets(sockets)
+        return f"http://{listen}:{sockets[0].getsockname()[1]}/bot"
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
@@ -0,0 +1,413 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, or_, select
+from telegram import Update
+from telegram.ext import ConversationHandler, TypeHandler
+
+from benchmarks.fake_bot_api import FakeBotApi
+from bot.callback_data import Action, decode
+from bot.keyboards import (
+    create_ad_callback,
+    conversation_skip_image_callback,
+    publish_ad_callback,
+    validation_ad_callback,
+    view_ad_callback,
+)
+from database.categories import category_registry
+from database.db_config import async_session, engine
+from database.entities import (
+    Ad,
+    ArchivedAd,
+    Image,
+    MessageId,
+    PersistenceEntry,
+    PublishJob,
+    User,
+)
+from database.migrations import database_init
+from database.models import CreateUserRequest
+from database.services import create_or_update_user, set_user_is_admin
+from main import application_builder, handlers_register
+
+load_bot_token = "123456:load-test"
+load_telegram_id = 9_100_000_000
+update_timeout = 60
+completion_group = 1_000
+words = (
+    "диван",
+    "стол",
+    "квартира",
+    "велосипед",
+    "ремонт",
+    "ноутбук",
+    "телефон",
+    "уборка",
+    "шкаф",
+    "репетитор",
+)
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+
+    def record(self, name, started):
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+
+
+def percentile(latencies, fraction):
+    return latencies[max(0, int(len(latencies) * fraction) - 1)]
+
+
+def timed(name, callback, stats):
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            stats.errors[name] += 1
+            raise
+        finally:
+            stats.record(name, started)
+
+    return wrapper
+
+
+def instrument(handlers, stats):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument(handler.entry_points, stats)
+            for state_handlers in handler.states.values():
+                instrument(state_handlers, stats)
+            instrument(handler.fallbacks, stats)
+        else:
+            handler.callback = timed(
+                f"handler:{handler.callback.__name__}", handler.callback, stats
+            )
+
+
+class LoadClient:
+    def __init__(self, application, api, stats, think_time):
+        self.application = application
+        self.api = api
+        self.stats = stats
+        self.think_time = think_time
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.pending = {}
+        application.add_handler(TypeHandler(Update, self.completed), completion_group)
+
+    async def completed(self, update, context):
+        future = self.pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def send(self, kind, data):
+        update_id = next(self.update_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[update_id] = future
+        started = time.perf_counter()
+        await self.application.update_queue.put(
+            Update.de_json({"update_id": update_id, **data}, self.application.bot)
+        )
+        try:
+            await asyncio.wait_for(future, update_timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(update_id, None)
+            self.stats.errors[f"update:{kind}"] += 1
+        self.stats.record(f"update:{kind}", started)
+        if self.think_time:
+            await asyncio.sleep(random.uniform(0, self.think_time * 2))
+
+    def _user(self, user_id):
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": "Load",
+            "username": f"load{user_id}",
+        }
+
+    def _chat(self, user_id):
+        return {
+            "id": user_id,
+            "type": "private",
+            "first_name": "Load",
+            "username": f"load{user_id}",
+        }
+
+    async def message(self, kind, user_id, **fields):
+        await self.send(
+            kind,
+            {
+                "message": {
+                    "message_id": next(self.message_ids),
+                    "date": int(time.time()),
+                    "chat": self._chat(user_id),
+                    "from": self._user(user_id),
+                    **fields,
+                }
+            },
+        )
+
+    async def command(self, user_id, command):
+        await self.message(
+            command,
+            user_id,
+            text=f"/{command}",
+            entities=[{"type": "bot_command", "offset": 0, "length": len(command) + 1}],
+        )
+
+    async def callback(self, kind, user_id, data):
+        await self.send(
+            kind,
+            {
+                "callback_query": {
+                    "id": str(next(self.update_ids)),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": {
+                        "message_id": next(self.message_ids),
+                        "date": int(time.time()),
+                        "chat": self._chat(user_id),
+                        "text": "load",
+                    },
+                }
+            },
+        )
+
+    async def inline_query(self, user_id, query):
+        await self.send(
+            "inline_query",
+            {
+                "inline_query": {
+                    "id": str(next(self.update_ids)),
+                    "from": self._user(user_id),
+                    "query": query,
+                    "offset": "",
+                }
+            },
+        )
+
+    def latest_callbacks(self, user_id, action):
+        return [
+            data
+            for data in self.api.callback_data(user_id)
+            if getattr(decode(data), "action", None) is action
+        ]
+
+
+async def create_ad_session(client, user_id):
+    await client.command(user_id, "start")
+    await client.message(
+        "contact",
+        user_id,
+        contact={
+            "phone_number": "+70000000000",
+            "first_name": "Load",
+            "user_id": user_id,
+        },
+    )
+    await client.callback("create_ad", user_id, create_ad_callback)
+    await client.message(
+        "title", user_id, text=" ".join(random.sample(words, 2)).capitalize()
+    )
+    await client.message("description", user_id, text=" ".join(random.sample(words, 5)))
+    await client.message("cost", user_id, text=str(random.randint(100, 100_000)))
+    category = random.choice(category_registry.categories)
+    await client.callback("category", user_id, category.alias)
+    if random.random() < 0.5:
+        await client.message(
+            "photo",
+            user_id,
+            photo=[
+                {
+                    "file_id": f"load-photo-{user_id}",
+                    "file_unique_id": f"load-photo-{user_id}",
+                    "width": 1280,
+                    "height": 960,
+                }
+            ],
+        )
+    else:
+        await client.callback("skip_image", user_id, conversation_skip_image_callback)
+    await client.callback("publish", user_id, publish_ad_callback)
+
+
+async def browse_session(client, user_id, pages):
+    await client.callback("view_ads", user_id, view_ad_callback)
+    for _ in range(pages):
+        next_pages = client.latest_callbacks(user_id, Action.ADS_NEXT)
+        if not next_pages:
+            break
+        await client.callback("ads_page", user_id, next_pages[-1])
+    await client.inline_query(user_id, random.choice(words))
+
+
+async def moderation_session(client, admin_id, stopped):
+    approved = set()
+    await client.command(admin_id, "start")
+    while not stopped.is_set():
+        await client.callback("validation", admin_id, validation_ad_callback)
+        pending = [
+            data
+            for data in client.latest_callbacks(admin_id, Action.APPROVE_AD)
+            if data not in approved
+        ]
+        if not pending:
+            await asyncio.sleep(0.5)
+            continue
+        for data in pending:
+            approved.add(data)
+            await client.callback("approve", admin_id, data)
+
+
+async def cleanup(telegram_ids):
+    async with async_session() as session:
+        async with session.begin():
+            user_ids = select(User.id).where(User.telegram_id.in_(telegram_ids))
+            ad_ids = select(Ad.id).where(Ad.user_id.in_(user_ids))
+            await session.execute(delete(MessageId).where(MessageId.ad_id.in_(ad_ids)))
+            await session.execute(delete(Image).where(Image.ad_id.in_(ad_ids)))
+            await session.execute(
+                delete(PublishJob).where(PublishJob.ad_id.in_(ad_ids))
+            )
+            await session.execute(delete(Ad).where(Ad.user_id.in_(user_ids)))
+            await session.execute(
+                delete(ArchivedAd).where(ArchivedAd.user_id.in_(user_ids))
+            )
+            await session.execute(
+                delete(User).where(User.telegram_id.in_(telegram_ids))
+            )
+            await session.execute(
+                delete(PersistenceEntry).where(
+                    or_(
+                        PersistenceEntry.key.in_(
+                            [str(telegram_id) for telegram_id in telegram_ids]
+                        ),
+                        PersistenceEntry.key.in_(
+                            [
+                                json.dumps([telegram_id, telegram_id])
+                                for telegram_id in telegram_ids
+                            ]
+                        ),
+                    )
+                )
+            )
+
+
+def report(stats, api, elapsed):
+    updates = sum(
+        len(latencies)
+        for name, latencies in stats.latencies.items()
+        if name.startswith("update:")
+    )
+    print(f"Обновлений: {updates} за {elapsed:.1f} с ({updates / elapsed:.1f} upd/s)")
+    print(
+        f"{'':>40} {'count':>7} {'errors':>7} "
+        f"{'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    )
+    for name in sorted(stats.latencies):
+        latencies = sorted(stats.latencies[name])
+        print(
+            f"{name:>40} {len(latencies):7d} {stats.errors[name]:7d} "
+            f"{percentile(latencies, 0.5):7.1f}ms {percentile(latencies, 0.95):7.1f}ms "
+            f"{percentile(latencies, 0.99):7.1f}ms {latencies[-1]:7.1f}ms"
+        )
+    print("Вызовы Bot API:")
+    for method, count in api.calls.most_common():
+        print(f"{method:>40} {count:7d} (429: {api.floods[method]})")
+
+
+async def main(arguments):
+    os.environ.setdefault("TARGET_CHANNEL", "-1001000000000")
+    await database_init()
+    api = FakeBotApi(latency=arguments.latency / 1000, flood_rate=arguments.flood_rate)
+    base_url = api.start()
+    stats = LoadStats()
+    application = (
+        application_builder()
+        .token(load_bot_token)
+        .base_url(base_url)
+        .base_file_url(f"{base_url}/file")
+        .build()
+    )
+    handlers_register(application)
+    for handlers in application.handlers.values():
+        instrument(handlers, stats)
+    client = LoadClient(application, api, stats, arguments.think_time / 1000)
+    admin_ids = [load_telegram_id + index for index in range(arguments.admins)]
+    user_ids = [
+        load_telegram_id + arguments.admins + index for index in range(arguments.users)
+    ]
+    for admin_id in admin_ids:
+        await create_or_update_user(
+            CreateUserRequest(
+                first_name="Load",
+                last_name="Admin",
+                telegram_id=admin_id,
+                telegram_login=f"load{admin_id}",
+            )
+        )
+        await set_user_is_admin(admin_id, True)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    stopped = asyncio.Event()
+    moderators = [
+        asyncio.create_task(moderation_session(client, admin_id, stopped))
+        for admin_id in admin_ids
+    ]
+
+    async def user_session(user_id, delay):
+        await asyncio.sleep(delay)
+        await create_ad_session(client, user_id)
+        await browse_session(client, user_id, arguments.pages)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(
+                user_session(user_id, index / arguments.rate)
+                for index, user_id in enumerate(user_ids)
+            )
+        )
+        stopped.set()
+        await asyncio.gather(*moderators)
+        elapsed = time.perf_counter() - started
+    finally:
+        stopped.set()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await api.stop()
+        await cleanup(admin_ids + user_ids)
+        await engine.dispose()
+    report(stats, api, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный прогон обработчиков бота против фейкового Bot API. "
+        "Запускать только на отдельной тестовой базе данных"
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=5, help="сессий в секунду")
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--think-time", type=float, default=0, help="мс")
+    parser.add_argument("--latency", type=float, default=50, help="мс")
+    parser.add_argument("--flood-rate", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
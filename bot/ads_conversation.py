@@ -8,14 +8,11 @@ from telegram.ext import (
     filters,
 )
 
+from bot.broadcast import broadcaster
 from bot.keyboards import (
     create_ad_callback,
     send_contact_keyboard,
     category_ad_keyboard,
-    home_category_callback,
-    work_category_callback,
-    goods_category_callback,
-    services_category_callback,
     validate_keyboard,
     start_keyboard,
     return_to_start_callback,
@@ -25,15 +22,16 @@ from bot.keyboards import (
     conversation_skip_image_keyboard,
     publish_ad_keyboard,
 )
+from bot.media_groups import media_groups
+from database.categories import category_registry
 from database.models import CreateAdRequest
 from database.services import (
     check_user_phone_is_none,
     create_ad,
     fetch_all_admins,
-    fetch_category_by_alias,
     fetch_user_by_id,
-    save_photo_id_from_media_group,
 )
+from database.unit_of_work import after_commit
 
 TITLE, DESCRIPTION, COST, CATEGORY, IMAGE, SEND = range(6)
 
@@ -55,16 +53,7 @@ def conversation_handler():
             COST: [MessageHandler(filters.TEXT & ~filters.COMMAND, conversation_cost)],
             CATEGORY: [
                 CallbackQueryHandler(
-                    conversation_category, pattern=home_category_callback
-                ),
-                CallbackQueryHandler(
-                    conversation_category, pattern=work_category_callback
-                ),
-                CallbackQueryHandler(
-                    conversation_category, pattern=goods_category_callback
-                ),
-                CallbackQueryHandler(
-                    conversation_category, pattern=services_category_callback
+                    conversation_category, pattern=category_registry.has_alias
                 ),
             ],
             IMAGE: [
@@ -81,6 +70,8 @@ def conversation_handler():
             CallbackQueryHandler(conversation_cancel, pattern=return_to_start_callback)
         ],
         allow_reentry=True,
+        name="ads_conversation",
+        persistent=True,
     )
 
 
@@ -178,7 +169,7 @@ async def conversation_cost(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"<b>Описание:</b> {description}\n\n"
             f"<b>Стоимость:</b> <b>{cost} руб.</b>\n\n"
             f"Теперь выберите категорию",
-            reply_markup=category_ad_keyboard,
+            reply_markup=category_ad_keyboard(),
             parse_mode=ParseMode.HTML,
         )
         return CATEGORY
@@ -196,8 +187,7 @@ async def conversation_category(update: Update, context: ContextTypes.DEFAULT_TY
         title = context.user_data["title"]
         description = context.user_data["description"]
         cost = context.user_data["cost"]
-        category_alias = update.callback_query.data
-        category = await fetch_category_by_alias(category_alias)
+        category = category_registry.by_alias[update.callback_query.data]
         context.user_data["category"] = category
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -224,28 +214,23 @@ async def conversation_image(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.callback_query.answer()
         message = update.effective_message
         if message.media_group_id:
-            jobs = context.job_queue.get_jobs_by_name("images_media_group_sender")
-            file_id = message.photo[-1].file_id
-            if jobs:
-                jobs[0].data["files"].append(file_id)
-            else:
-                context.job_queue.run_once(
-                    callback=process_images_handler,
-                    when=1,
-                    data={
-                        "files": [file_id],
-                        "media_id": message.media_group_id,
-                        "caption": {
-                            "title": context.user_data["title"],
-                            "description": context.user_data["description"],
-                            "cost": context.user_data["cost"],
-                            "category": context.user_data["category"],
-                        },
-                    },
-                    name="images_media_group_sender",
-                    chat_id=update.effective_chat.id,
+            accepted = media_groups.add(
+                job_queue=context.job_queue,
+                chat_id=update.effective_chat.id,
+                media_group_id=message.media_group_id,
+                file_id=message.photo[-1].file_id,
+                caption={
+                    "title": context.user_data["title"],
+                    "description": context.user_data["description"],
+                    "cost": context.user_data["cost"],
+                    "category": context.user_data["category"],
+                },
+                callback=process_images_handler,
+            )
+            if not accepted:
+                await message.reply_text(
+                    text="Сейчас слишком много загрузок, попробуйте отправить фото позже"
                 )
-            await save_photo_id_from_media_group(file_id, message.media_group_id)
             return IMAGE
         else:
             if update.callback_query:
@@ -261,7 +246,6 @@ async def conversation_image(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 cost = context.user_data["cost"]
                 category = context.user_data["category"]
                 context.chat_data["photo_id"] = file_id
-                await save_photo_id_from_media_group(file_id)
                 await context.bot.send_photo(
                     chat_id=update.effective_chat.id,
                     photo=file_id,
@@ -281,8 +265,13 @@ async def conversation_image(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
 
-async def process_images_handler(context: ContextTypes.DEFAULT_TYPE):
-    caption = context.job.data["caption"]
+async def process_images_handler(context: ContextTypes.DEFAULT_TYPE, album):
+    if album.overflow:
+        await context.bot.send_message(
+            chat_id=album.chat_id, text="Максимальное количество фото - 5 штук"
+        )
+        return
+    caption = album.caption
     caption_text = (
         f'<b>Заголовок:</b> {caption["title"]}\n\n'
         f'<b>Описание:</b> {caption["description"]}\n\n'
@@ -295,25 +284,17 @@ async def process_images_handler(context: ContextTypes.DEFAULT_TYPE):
             caption=caption_text if index == 0 else None,
             parse_mode=ParseMode.HTML,
         )
-        for index, file_id in enumerate(context.job.data["files"])
+        for index, file_id in enumerate(album.files)
     ]
     context.chat_data["files"] = files
-    if len(files) > 5:
-        await context.bot.send_message(
-            chat_id=context.job.chat_id, text="Максимальное количество фото - 5 штук"
-        )
-    else:
-        await context.bot.send_media_group(
-            chat_id=context.job.chat_id,
-            media=files,
-        )
-        await context.bot.send_message(
-            chat_id=context.job.chat_id,
-            text="Для публикации нажмите на кнопку",
-            reply_markup=publish_ad_keyboard,
-        )
-        context.chat_data["media_id"] = context.job.data["media_id"]
-    return ConversationHandler.END
+    await context.bot.send_media_group(chat_id=album.chat_id, media=files)
+    await context.bot.send_message(
+        chat_id=album.chat_id,
+        text="Для публикации нажмите на кнопку",
+        reply_markup=publish_ad_keyboard,
+    )
+    context.chat_data["media_id"] = album.media_group_id
+    context.chat_data["image_ids"] = album.files
 
 
 async def conversation_publish(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -326,6 +307,12 @@ async def conversation_publish(update: Update, context: ContextTypes.DEFAULT_TYP
         category = context.user_data["category"]
         file_id = context.chat_data.get("photo_id") or None
         media_id = context.chat_data.get("media_id") or None
+        if file_id:
+            image_ids = [file_id]
+        elif media_id:
+            image_ids = context.chat_data.get("image_ids") or []
+        else:
+            image_ids = []
         create_ad_response = await create_ad(
             CreateAdRequest(
                 user_id=user_id,
@@ -337,44 +324,21 @@ async def conversation_publish(update: Update, context: ContextTypes.DEFAULT_TYP
                 category_title=category.title,
                 category_id=category.id,
                 media_id=media_id,
+                image_ids=image_ids,
             )
         )
-        users = await fetch_all_admins()
-        for user in users:
-            if file_id:
-                await context.bot.send_photo(
-                    chat_id=user.telegram_id,
-                    photo=file_id,
-                    caption=f"{create_ad_response.__str__()}",
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=validate_keyboard(create_ad_response.ad_id),
-                )
-            elif media_id:
-                files = [
-                    InputMediaPhoto(
-                        media=file.media,
-                        caption=create_ad_response.__str__() if index == 0 else None,
-                        parse_mode=ParseMode.HTML,
-                    )
-                    for index, file in enumerate(context.chat_data["files"])
-                ]
-                context.chat_data["files"] = files
-                await context.bot.send_media_group(
-                    chat_id=user.telegram_id, media=files
-                )
-                await context.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text="Подтвердите или отклоните объявление",
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=validate_keyboard(create_ad_response.ad_id),
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=f"{create_ad_response.__str__()}",
+        if media_id:
+            files = [
+                InputMediaPhoto(
+                    media=file.media,
+                    caption=create_ad_response.__str__() if index == 0 else None,
                     parse_mode=ParseMode.HTML,
-                    reply_markup=validate_keyboard(create_ad_response.ad_id),
                 )
+                for index, file in enumerate(context.chat_data["files"])
+            ]
+            context.chat_data["files"] = files
+        else:
+            files = None
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Ваше объявление принято и после модерации будет "
@@ -382,8 +346,15 @@ async def conversation_publish(update: Update, context: ContextTypes.DEFAULT_TYP
             "Нажмите /start для возврата в главное меню",
             parse_mode=ParseMode.HTML,
         )
+        after_commit(
+            lambda: context.application.create_task(
+                send_ad_to_admins(context.bot, create_ad_response, file_id, files),
+                update=update,
+            )
+        )
         context.chat_data["photo_id"] = None
         context.chat_data["media_id"] = None
+        context.chat_data["image_ids"] = None
         return ConversationHandler.END
     else:
         await update.callback_query.answer()
@@ -393,6 +364,39 @@ async def conversation_publish(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+async def send_ad_to_admins(bot, ad, file_id, files):
+    async def send(chat_id, call):
+        if file_id:
+            await call(
+                bot.send_photo,
+                chat_id=chat_id,
+                photo=file_id,
+                caption=f"{ad.__str__()}",
+                parse_mode=ParseMode.HTML,
+                reply_markup=validate_keyboard(ad.ad_id),
+            )
+        elif files:
+            await call(bot.send_media_group, chat_id=chat_id, media=files)
+            await call(
+                bot.send_message,
+                chat_id=chat_id,
+                text="Подтвердите или отклоните объявление",
+                parse_mode=ParseMode.HTML,
+                reply_markup=validate_keyboard(ad.ad_id),
+            )
+        else:
+            await call(
+                bot.send_message,
+                chat_id=chat_id,
+                text=f"{ad.__str__()}",
+                parse_mode=ParseMode.HTML,
+                reply_markup=validate_keyboard(ad.ad_id),
+            )
+
+    users = await fetch_all_admins()
+    return await broadcaster.broadcast([user.telegram_id for user in users], send)
+
+
 async def conversation_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = context.user_data.get("user_id")
     if user_id:
@@ -0,0 +1,51 @@
+import re
+
+from telegram import Update
+from telegram.ext import Application
+
+from bot.callback_data import decode
+from bot.startup import startup
+from database.migrations import database_init
+from database.profiler import query_profiler
+from database.routing import current_user
+from database.unit_of_work import unit_of_work
+
+update_label_length = 64
+
+
+def update_label(update):
+    if not isinstance(update, Update):
+        return "other"
+    if update.callback_query and update.callback_query.data:
+        decoded = decode(update.callback_query.data)
+        if decoded is not None:
+            return f"callback_query:{decoded.action.name.lower()}"
+        data = re.sub(r"\d+", "", update.callback_query.data)
+        return f"callback_query:{data[:update_label_length]}"
+    if update.message and update.message.text and update.message.text[0] == "/":
+        return "command"
+    for field in ("message", "inline_query", "chosen_inline_result", "my_chat_member"):
+        if getattr(update, field):
+            return field
+    return "other"
+
+
+class BotApplication(Application):
+    async def initialize(self):
+        async with startup.step("migrations"):
+            await database_init()
+        async with startup.step("initialize"):
+            await super().initialize()
+
+    async def process_update(self, update: object):
+        user = update.effective_user if isinstance(update, Update) else None
+        token = current_user.set(user.id if user else None)
+        label = update_label(update)
+        try:
+            async with unit_of_work(label):
+                with query_profiler.scope(label):
+                    await super().process_update(update)
+        except Exception as error:
+            await self.process_error(update, error)
+        finally:
+            current_user.reset(token)
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable
+
+from telegram.error import TelegramError
+
+from bot.rate_limiter import Priority
+
+broadcast_concurrency = int(os.getenv("BROADCAST_CONCURRENCY", 8))
+
+
+@dataclass
+class BroadcastResult:
+    chat_id: int
+    ok: bool
+    attempts: int
+    error: str = None
+
+
+class Broadcaster:
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+
+    async def _send_to(self, chat_id, send, semaphore):
+        attempts = 0
+
+        async def call(method, **kwargs):
+            nonlocal attempts
+            attempts += 1
+            return await method(**kwargs, rate_limit_args=Priority.BROADCAST)
+
+        async with semaphore:
+            try:
+                await send(chat_id, call)
+            except TelegramError as error:
+                return BroadcastResult(chat_id, False, attempts, str(error))
+            return BroadcastResult(chat_id, True, attempts)
+
+    async def broadcast(
+        self,
+        chat_ids: Iterable[int],
+        send: Callable[[int, Callable[..., Awaitable]], Awaitable],
+    ):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self._send_to(chat_id, send, semaphore) for chat_id in set(chat_ids))
+        )
+        failed = [result for result in results if not result.ok]
+        logging.info(
+            "Рассылка завершена: доставлено %s из %s",
+            len(results) - len(failed),
+            len(results),
+        )
+        for result in failed:
+            logging.error(
+                "Не удалось отправить сообщение в чат %s: %s",
+                result.chat_id,
+                result.error,
+            )
+        return results
+
+
+broadcaster = Broadcaster(concurrency=broadcast_concurrency)
@@ -0,0 +1,141 @@
+import re
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+
+from telegram.ext import CallbackQueryHandler
+
+from metrics import metrics
+
+callback_data_version = "1"
+callback_data_limit = 64
+id_separator = "."
+id_base = 36
+decode_cache_size = 4096
+
+
+class Action(Enum):
+    START = "s"
+    VIEW_ADS = "v"
+    ADS_NEXT = "n"
+    ADS_PREV = "p"
+    MODERATION_QUEUE = "q"
+    APPROVE_AD = "a"
+    DISAPPROVE_AD = "d"
+    UNPUBLISH_AD = "x"
+    UNPUBLISH_ALL = "u"
+    PUBLISH_AD = "P"
+
+
+actions_by_code = {action.value: action for action in Action}
+action_arity = {
+    Action.ADS_NEXT: 1,
+    Action.ADS_PREV: 1,
+    Action.APPROVE_AD: 1,
+    Action.DISAPPROVE_AD: 1,
+    Action.UNPUBLISH_AD: 1,
+}
+legacy_static = {
+    "return_to_start_callback": Action.START,
+    "view_ad": Action.VIEW_ADS,
+    "validation_ad": Action.MODERATION_QUEUE,
+    "publish_ad_callback": Action.PUBLISH_AD,
+    "unpublish_all_ads": Action.UNPUBLISH_ALL,
+}
+legacy_pattern = re.compile(
+    r"(approve_ad|disapprove_ad|delete_ad|ads_page_next|ads_page_prev)_(\d+)"
+)
+legacy_actions = {
+    "approve_ad": Action.APPROVE_AD,
+    "disapprove_ad": Action.DISAPPROVE_AD,
+    "delete_ad": Action.UNPUBLISH_AD,
+    "ads_page_next": Action.ADS_NEXT,
+    "ads_page_prev": Action.ADS_PREV,
+}
+digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+@dataclass(frozen=True)
+class CallbackData:
+    action: Action
+    ids: tuple
+
+
+def to_base36(value):
+    if value < 0:
+        raise ValueError(f"Идентификатор не может быть отрицательным: {value}")
+    encoded = ""
+    while True:
+        value, remainder = divmod(value, id_base)
+        encoded = digits[remainder] + encoded
+        if not value:
+            return encoded
+
+
+def encode(action: Action, *ids):
+    data = (
+        callback_data_version
+        + action.value
+        + id_separator.join(to_base36(int(value)) for value in ids)
+    )
+    if len(data.encode()) > callback_data_limit:
+        raise ValueError(
+            f"callback_data длиннее {callback_data_limit} байт: {len(data.encode())}"
+        )
+    return data
+
+
+@lru_cache(maxsize=decode_cache_size)
+def decode(data):
+    if not data:
+        return None
+    if data[0] == callback_data_version:
+        action = actions_by_code.get(data[1:2])
+        if action is None:
+            return None
+        try:
+            ids = tuple(
+                int(value, id_base) for value in data[2:].split(id_separator) if value
+            )
+        except ValueError:
+            return None
+        if len(ids) != action_arity.get(action, 0):
+            return None
+        return CallbackData(action, ids)
+    action = legacy_static.get(data)
+    if action is not None:
+        return CallbackData(action, ())
+    match = legacy_pattern.fullmatch(data)
+    if match:
+        return CallbackData(legacy_actions[match.group(1)], (int(match.group(2)),))
+    return None
+
+
+class CallbackRouter:
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, action: Action, callback):
+        self.routes[action] = metrics.timed(
+            "bot_callback", "action", action.name.lower(), callback
+        )
+
+    def matches(self, data):
+        if not isinstance(data, str):
+            return None
+        decoded = decode(data)
+        if decoded is None or decoded.action not in self.routes:
+            return None
+        return decoded
+
+    async def dispatch(self, update, context):
+        decoded = context.decoded_callback
+        return await self.routes[decoded.action](update, context, *decoded.ids)
+
+    def handler(self):
+        return CallbackRouterHandler(self.dispatch, pattern=self.matches)
+
+
+class CallbackRouterHandler(CallbackQueryHandler):
+    def collect_additional_context(self, context, update, application, check_result):
+        context.decoded_callback = check_result
@@ -1,7 +1,5 @@
 import json
 import logging
-import os
-import re
 import textwrap
 import traceback
 from pydoc import html
@@ -15,17 +13,27 @@ from bot.keyboards import (
     ad_keyboard,
     start_keyboard_admin,
     validate_keyboard,
+    ads_page_keyboard,
+    moderation_queue_keyboard,
 )
+from bot.publisher import publish_outbox_job, delete_channel_messages
+from database.categories import category_registry
 from database.models import CreateUserRequest
+from database.profiler import query_profiler
+from database.routing import session_router
+from database.unit_of_work import after_commit
 from database.services import (
     create_or_update_user,
     add_phone_to_user,
     fetch_ads_by_user,
-    unpublished_ad,
-    set_publish_ad_id,
+    unpublish_ads,
+    approve_ad,
     fetch_ads_to_validate,
     fetch_ad_by_id,
     reject_ad,
+    fetch_user_by_id,
+    flush_last_logins,
+    moderation_lease_seconds,
 )
 
 
@@ -48,13 +56,18 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def view_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def view_ads_handler(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    after_id: int = None,
+    before_id: int = None,
+):
     user_id = context.user_data.get("user_id") or None
     if user_id:
         await update.callback_query.answer()
-        status, ads_result = await fetch_ads_by_user(user_id)
-        if status:
-            for ad in ads_result:
+        page = await fetch_ads_by_user(user_id, after_id=after_id, before_id=before_id)
+        if page.ads:
+            for ad in page.ads:
                 if len(ad.image_ids) > 1:
                     await context.bot.send_media_group(
                         chat_id=update.effective_chat.id,
@@ -88,9 +101,26 @@ async def view_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         reply_markup=ad_keyboard(ad.ad_id),
                         parse_mode=ParseMode.HTML,
                     )
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=(
+                    "Листайте объявления кнопками ниже"
+                    if page.previous_before_id or page.next_after_id
+                    else "Выберите действие"
+                ),
+                reply_markup=ads_page_keyboard(
+                    page.previous_before_id, page.next_after_id
+                ),
+            )
+        elif after_id or before_id:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="Больше объявлений нет",
+                reply_markup=start_keyboard,
+            )
         else:
             await context.bot.send_message(
-                chat_id=update.effective_chat.id, text=ads_result
+                chat_id=update.effective_chat.id, text="Нет объявлений"
             )
     else:
         await context.bot.send_message(
@@ -99,16 +129,25 @@ async def view_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-async def delete_ad_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def view_previous_ads_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, before_id: int
+):
+    await view_ads_handler(update, context, before_id=before_id)
+
+
+async def delete_ad_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, ad_id: int
+):
     user_id = context.user_data.get("user_id") or None
     if user_id:
         await update.callback_query.answer()
-        ad_id = re.findall(r"\d+", update.callback_query.data)[0]
-        ad = await unpublished_ad(ad_id)
-        for message in ad.messages:
-            await context.bot.delete_message(
-                chat_id=os.getenv("TARGET_CHANNEL"), message_id=message.message_id
+        unpublished = await unpublish_ads(ad_ids=[ad_id])
+        after_commit(
+            lambda: context.application.create_task(
+                delete_channel_messages(context.bot, unpublished.message_ids),
+                update=update,
             )
+        )
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Объявление снято с публикации",
@@ -121,6 +160,66 @@ async def delete_ad_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def unpublish_all_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = context.user_data.get("user_id") or None
+    if user_id:
+        await update.callback_query.answer()
+        unpublished = await unpublish_ads(user_telegram_id=user_id)
+        after_commit(
+            lambda: context.application.create_task(
+                delete_channel_messages(context.bot, unpublished.message_ids),
+                update=update,
+            )
+        )
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Все объявления сняты с публикации",
+            reply_markup=start_keyboard,
+        )
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Вы не залогинены. Для логина, сначала нажмите /start",
+        )
+
+
+async def takedown_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = context.user_data.get("user_id") or None
+    if user_id and (await fetch_user_by_id(user_id)).is_admin:
+        if (
+            context.args[:1] == ["user"]
+            and len(context.args) == 2
+            and context.args[1].isdigit()
+        ):
+            unpublished = await unpublish_ads(user_telegram_id=context.args[1])
+        elif context.args and all(arg.isdigit() for arg in context.args):
+            unpublished = await unpublish_ads(ad_ids=context.args)
+        else:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="Использование: /takedown <id объявления> ... "
+                "или /takedown user <telegram id>",
+            )
+            return
+        after_commit(
+            lambda: context.application.create_task(
+                delete_channel_messages(context.bot, unpublished.message_ids),
+                update=update,
+            )
+        )
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Снято с публикации, удалено сообщений: "
+            f"{len(unpublished.message_ids)}, "
+            f"отменено публикаций: {unpublished.cancelled}",
+        )
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Команда доступна только администраторам",
+        )
+
+
 async def add_phone_to_user_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = context.user_data.get("user_id")
     if user_id:
@@ -142,7 +241,7 @@ async def validate_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = context.user_data.get("user_id") or None
     if user_id:
         await update.callback_query.answer()
-        ads_result = await fetch_ads_to_validate()
+        ads_result = await fetch_ads_to_validate(update.effective_chat.id)
         if len(ads_result) > 0:
             for ad in ads_result:
                 if len(ad.image_ids) > 1:
@@ -163,7 +262,6 @@ async def validate_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYP
                         text="Нажмите кнопку чтобы подтвердить "
                         "или отклонить объявление",
                     )
-                    context.chat_data["files"] = media
                 elif len(ad.image_ids) == 1:
                     await context.bot.send_photo(
                         chat_id=update.effective_chat.id,
@@ -180,6 +278,13 @@ async def validate_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYP
                         parse_mode=ParseMode.HTML,
                     )
                 context.bot_data["ad_user_id"] = ad.user_telegram
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="Эти объявления закреплены за вами на "
+                f"{moderation_lease_seconds // 60} мин. Когда закончите, "
+                "запросите следующие",
+                reply_markup=moderation_queue_keyboard,
+            )
         else:
             await context.bot.send_message(
                 chat_id=update.effective_chat.id, text="Нет объявлений"
@@ -192,72 +297,43 @@ async def validate_ads_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
-async def validate_ad_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def validate_ad_handler(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    ad_id: int,
+    approve: bool = True,
+):
     user_id = context.user_data.get("user_id") or None
     if user_id:
         await update.callback_query.answer()
-        ad_id = re.findall(r"\d+", update.callback_query.data)[0]
-        ads = await fetch_ad_by_id(ad_id=ad_id)
-        if update.callback_query.data.startswith("approve"):
-            for ad in ads:
-                if ad.is_published:
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text="Данное объявление уже опубликовано",
-                    )
-                else:
-                    if len(ad.images) > 1:
-                        results = await context.bot.send_media_group(
-                            chat_id=os.getenv("TARGET_CHANNEL"),
-                            media=context.chat_data["files"],
-                        )
-                        message_ids = [
-                            {"message_id": int(result.id), "ad_id": int(ad_id)}
-                            for result in results
-                        ]
-                        await set_publish_ad_id(message_ids)
-                        context.chat_data["files"] = None
-                    elif len(ad.images) == 1:
-                        result = await context.bot.send_photo(
-                            chat_id=os.getenv("TARGET_CHANNEL"),
-                            photo=update.effective_message.photo[-1].file_id,
-                            caption=update.effective_message.caption,
-                        )
-                        await set_publish_ad_id(
-                            [
-                                {
-                                    "message_id": int(result.message_id),
-                                    "ad_id": int(ad_id),
-                                }
-                            ]
-                        )
-                    else:
-                        result = await context.bot.send_message(
-                            chat_id=os.getenv("TARGET_CHANNEL"),
-                            text=update.effective_message.text,
-                            parse_mode=ParseMode.HTML,
-                        )
-                        await set_publish_ad_id(
-                            [
-                                {
-                                    "message_id": int(result.message_id),
-                                    "ad_id": int(ad_id),
-                                }
-                            ]
-                        )
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id, text="Объявление опубликовано"
-                    )
-                    await context.bot.send_message(
-                        chat_id=ad.user.telegram_id,
-                        text="Ваше объявление опубликовано",
-                        reply_markup=start_keyboard,
-                    )
-                    context.bot_data["ad_user_id"] = ad.user.telegram_id
+        ad = await fetch_ad_by_id(ad_id=ad_id)
+        if ad is None:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id, text="Объявление не найдено"
+            )
+        elif approve:
+            if ad.is_published:
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text="Данное объявление уже опубликовано",
+                )
+            elif await approve_ad(ad_id):
+                after_commit(
+                    lambda: context.job_queue.run_once(publish_outbox_job, when=0)
+                )
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text="Объявление одобрено и будет опубликовано в канале",
+                )
+                context.bot_data["ad_user_id"] = ad.user_telegram_id
+            else:
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text="Данное объявление уже ожидает публикации",
+                )
         else:
-            ad = ads[0]
             await reject_ad(ad_id)
-            context.bot_data["ad_user_id"] = ad.user.telegram_id
+            context.bot_data["ad_user_id"] = ad.user_telegram_id
             context.chat_data["is_reject"] = True
             await context.bot.send_message(
                 chat_id=update.effective_chat.id, text="Напиши причину отклонения"
@@ -269,6 +345,12 @@ async def validate_ad_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
 
+async def disapprove_ad_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, ad_id: int
+):
+    await validate_ad_handler(update, context, ad_id, approve=False)
+
+
 async def reject_ad_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = context.user_data.get("user_id") or None
     if user_id:
@@ -300,6 +382,63 @@ async def reject_ad_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def reload_categories_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = context.user_data.get("user_id") or None
+    if user_id and (await fetch_user_by_id(user_id)).is_admin:
+        await category_registry.load()
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Категории обновлены: {len(category_registry.categories)}",
+        )
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Команда доступна только администраторам",
+        )
+
+
+async def profiler_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = context.user_data.get("user_id") or None
+    if user_id and (await fetch_user_by_id(user_id)).is_admin:
+        action = context.args[0] if context.args else "top"
+        if action == "on":
+            query_profiler.enable()
+        elif action == "off":
+            query_profiler.disable()
+        elif action == "reset":
+            query_profiler.reset()
+        lines = [
+            f"Профилировщик {'включен' if query_profiler.enabled else 'выключен'}, "
+            f"медленных запросов: {query_profiler.slow_queries}, "
+            f"N+1: {query_profiler.n_plus_one}"
+        ]
+        for statement, stats in query_profiler.top(10):
+            lines.append(
+                f"{stats.count} × {stats.total * 1000:.0f} мс "
+                f"(макс. {stats.max * 1000:.0f} мс): {statement[:150]}"
+            )
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id, text="\n\n".join(lines)
+        )
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Команда доступна только администраторам",
+        )
+
+
+async def refresh_categories_job(context: ContextTypes.DEFAULT_TYPE):
+    await category_registry.load()
+
+
+async def check_replicas_job(context: ContextTypes.DEFAULT_TYPE):
+    await session_router.check_replicas()
+
+
+async def flush_last_logins_job(context: ContextTypes.DEFAULT_TYPE):
+    await flush_last_logins()
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logging.error("Произошла ошибка при работе бота:", exc_info=context.error)
     tb_list = traceback.format_exception(
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import re
+
+from telegram import (
+    Update,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent,
+)
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+
+from database.categories import category_registry
+from database.models import SearchQuery
+from database.services import search_ads
+
+inline_search_timeout = float(os.getenv("INLINE_SEARCH_TIMEOUT", 3))
+inline_search_cache_time = int(os.getenv("INLINE_SEARCH_CACHE_TIME", 30))
+inline_search_max_offset = int(os.getenv("INLINE_SEARCH_MAX_OFFSET", 1000))
+inline_search_max_terms = 8
+
+search_token_pattern = re.compile(r"#(\w+)|([<>])\s*(\d+)|([^\W_]+)")
+
+
+def parse_search_query(query: str):
+    search = SearchQuery(terms=[])
+    for category, operator, cost, term in search_token_pattern.findall(query):
+        if category:
+            found = category_registry.by_title.get(category.casefold())
+            if found is not None:
+                search.category_id = found.id
+        elif operator == ">":
+            search.min_cost = int(cost)
+        elif operator == "<":
+            search.max_cost = int(cost)
+        elif len(search.terms) < inline_search_max_terms:
+            search.terms.append(term.lower())
+    return search
+
+
+def ad_inline_result(ad):
+    if ad.image_ids:
+        return InlineQueryResultCachedPhoto(
+            id=str(ad.ad_id),
+            photo_file_id=ad.image_ids[0],
+            title=ad.title,
+            caption=ad.__str__(),
+            parse_mode=ParseMode.HTML,
+        )
+    return InlineQueryResultArticle(
+        id=str(ad.ad_id),
+        title=ad.title,
+        description=f"{ad.cost} руб. · {ad.category}",
+        input_message_content=InputTextMessageContent(
+            ad.__str__(), parse_mode=ParseMode.HTML
+        ),
+    )
+
+
+async def inline_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline_query = update.inline_query
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    try:
+        page = await asyncio.wait_for(
+            search_ads(parse_search_query(inline_query.query), offset),
+            inline_search_timeout,
+        )
+    except asyncio.TimeoutError:
+        logging.warning("Поиск по запросу %r не уложился в срок", inline_query.query)
+        await inline_query.answer([], cache_time=0)
+        return
+    next_offset = page.next_offset
+    if next_offset is not None and next_offset > inline_search_max_offset:
+        next_offset = None
+    await inline_query.answer(
+        [ad_inline_result(ad) for ad in page.ads],
+        cache_time=inline_search_cache_time,
+        next_offset=str(next_offset) if next_offset is not None else "",
+    )
@@ -5,21 +5,19 @@ from telegram import (
     KeyboardButton,
 )
 
+from bot.callback_data import Action, encode
+from database.categories import category_registry
+
 create_ad_callback = "create_ad"
 return_to_start_callback = "return_to_start_callback"
 conversation_skip_image_callback = "conversation_skip_image_callback"
-view_ad_callback = "view_ad"
-validation_ad_callback = "validation_ad"
+view_ad_callback = encode(Action.VIEW_ADS)
+validation_ad_callback = encode(Action.MODERATION_QUEUE)
 cancel_callback = "cancel_callback"
 send_ad_title_callback = "send_ad_title_callback"
 send_ad_description_callback = "send_ad_description_callback"
-publish_ad_callback = "publish_ad_callback"
-approve_ad_callback = "approve_ad_callback"
-disapprove_ad_callback = "disapprove_ad_callback"
-home_category_callback = "home_category_callback"
-work_category_callback = "work_category_callback"
-goods_category_callback = "goods_category_callback"
-services_category_callback = "services_category_callback"
+publish_ad_callback = encode(Action.PUBLISH_AD)
+unpublish_all_ads_callback = encode(Action.UNPUBLISH_ALL)
 send_contact_text = "Отправить контакт"
 publish_ad_text = "Опубликовать"
 
@@ -74,21 +72,22 @@ send_contact_keyboard = ReplyKeyboardMarkup(
     one_time_keyboard=True,
 )
 
-category_ad_keyboard = InlineKeyboardMarkup(
-    [
-        [
-            InlineKeyboardButton(text="Жилье", callback_data=home_category_callback),
-            InlineKeyboardButton(text="Работа", callback_data=work_category_callback),
-        ],
-        [
-            InlineKeyboardButton(text="Товары", callback_data=goods_category_callback),
-            InlineKeyboardButton(
-                text="Услуги", callback_data=services_category_callback
-            ),
-        ],
-        [InlineKeyboardButton(text="Отменить", callback_data=return_to_start_callback)],
+
+def category_ad_keyboard():
+    buttons = [
+        InlineKeyboardButton(text=category.title, callback_data=category.alias)
+        for category in category_registry.categories
     ]
-)
+    return InlineKeyboardMarkup(
+        [buttons[index : index + 2] for index in range(0, len(buttons), 2)]
+        + [
+            [
+                InlineKeyboardButton(
+                    text="Отменить", callback_data=return_to_start_callback
+                )
+            ]
+        ]
+    )
 
 
 def create_contact_keyboard(seller_contact):
@@ -102,7 +101,8 @@ def ad_keyboard(ad_id):
         [
             [
                 InlineKeyboardButton(
-                    text="Снять с публикации", callback_data=f"delete_ad_{ad_id}"
+                    text="Снять с публикации",
+                    callback_data=encode(Action.UNPUBLISH_AD, ad_id),
                 )
             ],
             [
@@ -119,10 +119,10 @@ def validate_keyboard(ad_id):
         [
             [
                 InlineKeyboardButton(
-                    text=publish_ad_text, callback_data=f"approve_ad_{ad_id}"
+                    text=publish_ad_text, callback_data=encode(Action.APPROVE_AD, ad_id)
                 ),
                 InlineKeyboardButton(
-                    text="Отклонить", callback_data=f"disapprove_ad_{ad_id}"
+                    text="Отклонить", callback_data=encode(Action.DISAPPROVE_AD, ad_id)
                 ),
             ],
             [
@@ -132,3 +132,52 @@ def validate_keyboard(ad_id):
             ],
         ]
     )
+
+
+moderation_queue_keyboard = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton(
+                text="Следующие объявления", callback_data=validation_ad_callback
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="В главное меню", callback_data=return_to_start_callback
+            )
+        ],
+    ]
+)
+
+
+def ads_page_keyboard(previous_before_id, next_after_id):
+    navigation = []
+    if previous_before_id is not None:
+        navigation.append(
+            InlineKeyboardButton(
+                text="« Назад",
+                callback_data=encode(Action.ADS_PREV, previous_before_id),
+            )
+        )
+    if next_after_id is not None:
+        navigation.append(
+            InlineKeyboardButton(
+                text="Далее »", callback_data=encode(Action.ADS_NEXT, next_after_id)
+            )
+        )
+    return InlineKeyboardMarkup(
+        [
+            navigation,
+            [
+                InlineKeyboardButton(
+                    text="Снять все с публикации",
+                    callback_data=unpublish_all_ads_callback,
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="В главное меню", callback_data=return_to_start_callback
+                )
+            ],
+        ]
+    )
@@ -0,0 +1,115 @@
+import logging
+import os
+import time
+
+from telegram.ext import ContextTypes
+
+from metrics import metrics
+
+media_group_debounce = float(os.getenv("MEDIA_GROUP_DEBOUNCE", 1))
+media_group_max_photos = 5
+media_group_max_pending = int(os.getenv("MEDIA_GROUP_MAX_PENDING", 10000))
+
+
+class Album:
+    __slots__ = ("chat_id", "media_group_id", "files", "received", "caption", "updated")
+
+    def __init__(self, chat_id, media_group_id, caption):
+        self.chat_id = chat_id
+        self.media_group_id = media_group_id
+        self.files = []
+        self.received = 0
+        self.caption = caption
+        self.updated = time.monotonic()
+
+    @property
+    def overflow(self):
+        return self.received > len(self.files)
+
+
+class MediaGroupAggregator:
+    def __init__(
+        self,
+        debounce=media_group_debounce,
+        max_photos=media_group_max_photos,
+        max_pending=media_group_max_pending,
+    ):
+        self.debounce = debounce
+        self.max_photos = max_photos
+        self.max_pending = max_pending
+        self.albums = {}
+        self.rejected = 0
+        self.dropped_photos = 0
+        metrics.add_collector(self.samples)
+
+    def add(self, job_queue, chat_id, media_group_id, file_id, caption, callback):
+        key = (chat_id, media_group_id)
+        album = self.albums.get(key)
+        if album is None:
+            if len(self.albums) >= self.max_pending:
+                self.rejected += 1
+                logging.warning(
+                    "Отклонен альбом %s: ожидают сборки %s альбомов",
+                    media_group_id,
+                    len(self.albums),
+                )
+                return False
+            album = self.albums[key] = Album(chat_id, media_group_id, caption)
+            job_queue.run_once(
+                callback=self._flush,
+                when=self.debounce,
+                data=(key, callback),
+                name=f"media_group_{chat_id}",
+                chat_id=chat_id,
+            )
+        album.received += 1
+        album.updated = time.monotonic()
+        if len(album.files) < self.max_photos:
+            album.files.append(file_id)
+        else:
+            self.dropped_photos += 1
+        return True
+
+    async def _flush(self, context: ContextTypes.DEFAULT_TYPE):
+        key, callback = context.job.data
+        album = self.albums.get(key)
+        if album is None:
+            return
+        remaining = album.updated + self.debounce - time.monotonic()
+        if remaining > 0:
+            context.job_queue.run_once(
+                callback=self._flush,
+                when=remaining,
+                data=context.job.data,
+                name=context.job.name,
+                chat_id=album.chat_id,
+            )
+            return
+        del self.albums[key]
+        await callback(context, album)
+
+    def samples(self):
+        yield (
+            "media_groups_pending",
+            "gauge",
+            "media_groups_pending",
+            (),
+            len(self.albums),
+        )
+        yield (
+            "media_groups_rejected_total",
+            "counter",
+            "media_groups_rejected_total",
+            (),
+            self.rejected,
+        )
+        yield (
+            "media_group_photos_dropped_total",
+            "counter",
+            "media_group_photos_dropped_total",
+            (),
+            self.dropped_photos,
+        )
+
+
+media_groups = MediaGroupAggregator()
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+
+from telegram import InputMediaPhoto
+from telegram.constants import ParseMode
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+
+from bot.keyboards import start_keyboard
+from bot.rate_limiter import Priority
+from database.services import (
+    claim_publish_jobs,
+    complete_publish_job,
+    fail_publish_job,
+    renew_publish_lease,
+    expire_ads,
+    ad_expiry_batch_size,
+)
+
+publish_outbox_interval = int(os.getenv("PUBLISH_OUTBOX_INTERVAL", 10))
+delete_messages_batch_size = 100
+ad_expiry_interval = int(os.getenv("AD_EXPIRY_INTERVAL", 3600))
+
+
+async def send_ad_to_channel(bot, ad):
+    channel = os.getenv("TARGET_CHANNEL")
+    if len(ad.image_ids) > 1:
+        results = await bot.send_media_group(
+            chat_id=channel,
+            media=[
+                InputMediaPhoto(
+                    media=file_id,
+                    caption=ad.__str__() if index == 0 else None,
+                    parse_mode=ParseMode.HTML,
+                )
+                for index, file_id in enumerate(ad.image_ids)
+            ],
+            rate_limit_args=Priority.CHANNEL,
+        )
+        return [result.message_id for result in results]
+    if len(ad.image_ids) == 1:
+        result = await bot.send_photo(
+            chat_id=channel,
+            photo=ad.image_ids[0],
+            caption=ad.__str__(),
+            parse_mode=ParseMode.HTML,
+            rate_limit_args=Priority.CHANNEL,
+        )
+        return [result.message_id]
+    result = await bot.send_message(
+        chat_id=channel,
+        text=ad.__str__(),
+        parse_mode=ParseMode.HTML,
+        rate_limit_args=Priority.CHANNEL,
+    )
+    return [result.message_id]
+
+
+async def delete_channel_messages(bot, message_ids):
+    channel = os.getenv("TARGET_CHANNEL")
+    if hasattr(bot, "delete_messages"):
+        calls = [
+            bot.delete_messages(
+                chat_id=channel,
+                message_ids=message_ids[start : start + delete_messages_batch_size],
+                rate_limit_args=Priority.CHANNEL,
+            )
+            for start in range(0, len(message_ids), delete_messages_batch_size)
+        ]
+    else:
+        calls = [
+            bot.delete_message(
+                chat_id=channel,
+                message_id=message_id,
+                rate_limit_args=Priority.CHANNEL,
+            )
+            for message_id in message_ids
+        ]
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    for result in results:
+        if isinstance(result, TelegramError):
+            logging.warning("Не удалось удалить сообщение из канала: %s", result)
+        elif isinstance(result, BaseException):
+            raise result
+
+
+async def publish_outbox_job(context: ContextTypes.DEFAULT_TYPE):
+    while tasks := await claim_publish_jobs():
+        for task in tasks:
+            if not await renew_publish_lease(task):
+                logging.info(
+                    "Задача публикации %s перехвачена другим обработчиком", task.job_id
+                )
+                continue
+            try:
+                message_ids = await send_ad_to_channel(context.bot, task.ad)
+            except TelegramError as error:
+                logging.error(
+                    "Не удалось опубликовать объявление %s (попытка %s): %s",
+                    task.ad.ad_id,
+                    task.attempts,
+                    error,
+                )
+                await fail_publish_job(task, error)
+                continue
+            if not await complete_publish_job(task, message_ids):
+                logging.warning(
+                    "Задача публикации %s отменена или перехвачена во время отправки, "
+                    "сообщения удаляются из канала",
+                    task.job_id,
+                )
+                await delete_channel_messages(context.bot, message_ids)
+                continue
+            try:
+                await context.bot.send_message(
+                    chat_id=task.ad.user_telegram_id,
+                    text="Ваше объявление опубликовано",
+                    reply_markup=start_keyboard,
+                )
+            except TelegramError as error:
+                logging.warning(
+                    "Не удалось уведомить автора объявления %s: %s",
+                    task.ad.ad_id,
+                    error,
+                )
+
+
+async def expire_ads_job(context: ContextTypes.DEFAULT_TYPE):
+    total = 0
+    while True:
+        batch = await expire_ads()
+        total += batch.archived
+        if batch.message_ids:
+            await delete_channel_messages(context.bot, batch.message_ids)
+        if batch.archived < ad_expiry_batch_size:
+            break
+    if total:
+        logging.info("Архивировано устаревших объявлений: %s", total)
@@ -0,0 +1,243 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import Counter, deque
+from enum import IntEnum
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from database.unit_of_work import commit_current
+from metrics import metrics
+
+outbound_global_rate = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+outbound_group_rate = float(os.getenv("OUTBOUND_GROUP_RATE", 20 / 60))
+outbound_chat_rate = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+outbound_max_retries = int(os.getenv("OUTBOUND_MAX_RETRIES", 3))
+idle_buckets_limit = 10000
+chat_exempt_endpoints = frozenset({"deleteMessage", "deleteMessages"})
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BROADCAST = 1
+    CHANNEL = 2
+
+
+def chat_key(chat_id):
+    with contextlib.suppress(ValueError, TypeError):
+        return int(chat_id)
+    return chat_id
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now, cost=1):
+        self._refill(now)
+        self.tokens -= cost
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    def __init__(
+        self,
+        global_rate=outbound_global_rate,
+        group_rate=outbound_group_rate,
+        chat_rate=outbound_chat_rate,
+        shared_chats=(),
+        workers=1,
+        max_retries=outbound_max_retries,
+    ):
+        self.global_rate = global_rate
+        self.group_rate = group_rate
+        self.chat_rate = chat_rate
+        self.shared_chats = frozenset(chat_key(chat_id) for chat_id in shared_chats)
+        self.workers = workers
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._queues = {priority: deque() for priority in Priority}
+        self._paused = {}
+        self._wakeup = None
+        self._dispatcher = None
+        self.requests = Counter()
+        self.retry_after_count = 0
+        metrics.add_collector(self.samples)
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._dispatcher
+            self._dispatcher = None
+        for waiting in self._queues.values():
+            for _, _, future in waiting:
+                if not future.done():
+                    future.set_result(None)
+            waiting.clear()
+
+    def stats(self):
+        return {
+            "queue_depth": {
+                priority.name.lower(): len(self._queues[priority])
+                for priority in Priority
+            },
+            "requests": dict(self.requests),
+            "retry_after": self.retry_after_count,
+        }
+
+    def samples(self):
+        for endpoint, count in self.requests.items():
+            yield (
+                "bot_api_requests_total",
+                "counter",
+                "bot_api_requests_total",
+                (("endpoint", endpoint),),
+                count,
+            )
+        yield (
+            "bot_api_retry_after_total",
+            "counter",
+            "bot_api_retry_after_total",
+            (),
+            self.retry_after_count,
+        )
+        for priority in Priority:
+            yield (
+                "bot_api_queue_depth",
+                "gauge",
+                "bot_api_queue_depth",
+                (("priority", priority.name.lower()),),
+                len(self._queues[priority]),
+            )
+
+    def _chat_rate(self, chat_id):
+        if isinstance(chat_id, str) or chat_id < 0:
+            rate = self.group_rate
+        else:
+            rate = self.chat_rate
+        if chat_id in self.shared_chats:
+            return rate / self.workers
+        return rate
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > idle_buckets_limit:
+                now = time.monotonic()
+                self._chats = {
+                    key: value
+                    for key, value in self._chats.items()
+                    if not value.is_full(now)
+                }
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate(chat_id), 1)
+        return bucket
+
+    def _chat_delay(self, chat_id, limited, now):
+        paused_until = self._paused.get(chat_id)
+        if paused_until is not None:
+            if paused_until > now:
+                return paused_until - now
+            del self._paused[chat_id]
+        return self._chat_bucket(chat_id).delay(now) if limited else 0
+
+    def _next_ready(self, now):
+        wait = None
+        for priority in Priority:
+            for entry in self._queues[priority]:
+                chat_id, limited, future = entry
+                if future.done():
+                    self._queues[priority].remove(entry)
+                    return None, 0
+                delay = self._chat_delay(chat_id, limited, now)
+                if delay == 0:
+                    self._queues[priority].remove(entry)
+                    return entry, 0
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _dispatch(self):
+        while True:
+            if not any(self._queues.values()):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            delay = self._global.delay(now)
+            if delay <= 0:
+                entry, delay = self._next_ready(now)
+                if entry is not None:
+                    chat_id, limited, future = entry
+                    self._global.take(now)
+                    if limited:
+                        self._chat_bucket(chat_id).take(now)
+                    future.set_result(None)
+                    continue
+                if delay == 0:
+                    continue
+            self._wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+
+    async def _acquire(self, priority, chat_id, limited):
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].append((chat_id, limited, future))
+        self._wakeup.set()
+        await future
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        self.requests[endpoint] += 1
+        await commit_current()
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._dispatcher is None:
+            return await callback(*args, **kwargs)
+        chat_id = chat_key(chat_id)
+        limited = endpoint not in chat_exempt_endpoints
+        priority = Priority(rate_limit_args or Priority.INTERACTIVE)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, chat_id, limited)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as error:
+                self.retry_after_count += 1
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(
+                    "Flood limit для %s в чат %s, пауза %s сек.",
+                    endpoint,
+                    chat_id,
+                    error.retry_after,
+                )
+                if len(self._paused) > idle_buckets_limit:
+                    now = time.monotonic()
+                    self._paused = {
+                        key: until for key, until in self._paused.items() if until > now
+                    }
+                self._paused[chat_id] = max(
+                    self._paused.get(chat_id, 0), time.monotonic() + error.retry_after
+                )
+                self._wakeup.set()
@@ -0,0 +1,64 @@
+import asyncio
+import contextlib
+import logging
+import time
+
+from database.db_config import engine, warm_pool
+from database.models import SearchQuery
+from database.services import fetch_ad_by_id, fetch_ads_by_user, search_ads
+from metrics import metrics
+
+
+async def prime_statements():
+    await fetch_ads_by_user(0)
+    await fetch_ad_by_id(0)
+    await search_ads(SearchQuery(terms=[]))
+
+
+class Startup:
+    def __init__(self):
+        self.ready = False
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    @contextlib.asynccontextmanager
+    async def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+    async def warm_up(self):
+        size = engine.pool.size()
+        async with self.step("pool"):
+            await warm_pool(size)
+        async with self.step("prepared_statements"):
+            await asyncio.gather(*(prime_statements() for _ in range(size)))
+
+    def finish(self):
+        self.ready = True
+        total = time.perf_counter() - self.started
+        logging.info(
+            "Бот готов за %.0f мс: %s",
+            total * 1000,
+            ", ".join(
+                f"{name} {elapsed * 1000:.0f} мс"
+                for name, elapsed in self.timings.items()
+            ),
+        )
+
+    def samples(self):
+        yield "bot_ready", "gauge", "bot_ready", (), int(self.ready)
+        for name, elapsed in self.timings.items():
+            yield (
+                "bot_startup_seconds",
+                "gauge",
+                "bot_startup_seconds",
+                (("step", name),),
+                elapsed,
+            )
+
+
+startup = Startup()
+metrics.add_collector(startup.samples)
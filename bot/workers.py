@@ -0,0 +1,318 @@
+import asyncio
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+
+from telegram import Bot, Update
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+
+from bot.startup import startup
+from metrics import metrics, metrics_push_interval, render
+
+worker_queue_size = int(os.getenv("WEBHOOK_WORKER_QUEUE_SIZE", 1000))
+worker_shutdown_timeout = float(os.getenv("WEBHOOK_WORKER_SHUTDOWN_TIMEOUT", 30))
+metrics_path = os.getenv("METRICS_PATH", "metrics")
+readiness_path = os.getenv("READINESS_PATH", "ready")
+
+chat_update_fields = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+user_update_fields = (
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+    "poll_answer",
+)
+
+
+def update_chat_id(update: dict):
+    for field in chat_update_fields:
+        if field in update:
+            return update[field]["chat"]["id"]
+    if "callback_query" in update:
+        callback_query = update["callback_query"]
+        message = callback_query.get("message")
+        if message:
+            return message["chat"]["id"]
+        return callback_query["from"]["id"]
+    for field in user_update_fields:
+        if field in update:
+            user = update[field].get("from") or update[field].get("user") or {}
+            return user.get("id")
+    return None
+
+
+def worker_index(update: dict, workers: int):
+    return (update_chat_id(update) or 0) % workers
+
+
+class IngressHandler(RequestHandler):
+    def initialize(self, queues, processes):
+        self.queues = queues
+        self.processes = processes
+
+    def post(self):
+        try:
+            update = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        index = worker_index(update, len(self.queues))
+        if not self.processes[index].is_alive():
+            logging.error("Воркер %s не работает, обновление отклонено", index)
+            self.set_status(503)
+            return
+        try:
+            self.queues[index].put_nowait(self.request.body)
+        except queue.Full:
+            logging.warning("Очередь воркера переполнена, обновление отклонено")
+            self.set_status(503)
+
+
+class WebhookHandler(RequestHandler):
+    def initialize(self, bot_application):
+        self.bot_application = bot_application
+
+    async def post(self):
+        try:
+            update = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        await self.bot_application.update_queue.put(
+            Update.de_json(update, self.bot_application.bot)
+        )
+
+
+class MetricsHandler(RequestHandler):
+    def initialize(self, samples):
+        self.samples = samples
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(render(self.samples()))
+
+
+class ReadinessHandler(RequestHandler):
+    def initialize(self, is_ready):
+        self.is_ready = is_ready
+
+    def get(self):
+        if self.is_ready():
+            self.write("ready")
+        else:
+            self.set_status(503)
+            self.write("starting")
+
+
+class WorkerMetrics:
+    def __init__(self, snapshots, workers):
+        self.snapshots = snapshots
+        self.workers = workers
+        self.latest = {}
+
+    def _drain(self):
+        with contextlib.suppress(queue.Empty):
+            while True:
+                index, samples = self.snapshots.get_nowait()
+                self.latest[index] = samples
+
+    async def collect(self):
+        while True:
+            self._drain()
+            await asyncio.sleep(metrics_push_interval)
+
+    def is_ready(self):
+        self._drain()
+        return all(
+            any(
+                name == "bot_ready" and value
+                for _, _, name, _, value in self.latest.get(index, ())
+            )
+            for index in range(self.workers)
+        )
+
+    def samples(self):
+        self._drain()
+        for index, samples in sorted(self.latest.items()):
+            for family, kind, name, labels, value in samples:
+                yield family, kind, name, (("worker", index),) + labels, value
+
+
+@contextlib.asynccontextmanager
+async def running(application):
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        yield application
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def wait_for_stop_signal():
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stopped.set)
+    await stopped.wait()
+
+
+async def push_metrics(index, snapshots):
+    while True:
+        snapshots.put_nowait((index, list(metrics.samples())))
+        await asyncio.sleep(metrics_push_interval)
+
+
+def run_worker(index, updates, snapshots, build_application):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.info("Воркер %s запущен", index)
+    asyncio.run(serve_worker(index, updates, snapshots, build_application))
+    logging.info("Воркер %s остановлен", index)
+
+
+async def serve_worker(index, updates, snapshots, build_application):
+    loop = asyncio.get_running_loop()
+    async with running(build_application()) as application:
+        pusher = asyncio.create_task(push_metrics(index, snapshots))
+        try:
+            while True:
+                body = await loop.run_in_executor(None, updates.get)
+                if body is None:
+                    break
+                await application.update_queue.put(
+                    Update.de_json(json.loads(body), application.bot)
+                )
+        finally:
+            pusher.cancel()
+
+
+async def serve_ingress(
+    token, queues, processes, snapshots, listen, port, url_path, webhook_url
+):
+    worker_metrics = WorkerMetrics(snapshots, len(queues))
+    server = HTTPServer(
+        WebApplication(
+            [
+                (
+                    rf"/{url_path}/?",
+                    IngressHandler,
+                    {"queues": queues, "processes": processes},
+                ),
+                (
+                    rf"/{metrics_path}/?",
+                    MetricsHandler,
+                    {"samples": worker_metrics.samples},
+                ),
+                (
+                    rf"/{readiness_path}/?",
+                    ReadinessHandler,
+                    {"is_ready": worker_metrics.is_ready},
+                ),
+            ]
+        )
+    )
+    server.listen(port, listen)
+    async with Bot(token) as bot:
+        await bot.set_webhook(webhook_url, allowed_updates=Update.ALL_TYPES)
+    logging.info("Приём вебхуков запущен на %s:%s", listen, port)
+    collector = asyncio.create_task(worker_metrics.collect())
+    try:
+        await wait_for_stop_signal()
+    finally:
+        collector.cancel()
+        server.stop()
+        await server.close_all_connections()
+
+
+async def serve_single(build_application, listen, port, url_path, webhook_url):
+    application = build_application()
+    server = HTTPServer(
+        WebApplication(
+            [
+                (rf"/{url_path}/?", WebhookHandler, {"bot_application": application}),
+                (rf"/{metrics_path}/?", MetricsHandler, {"samples": metrics.samples}),
+                (
+                    rf"/{readiness_path}/?",
+                    ReadinessHandler,
+                    {"is_ready": lambda: startup.ready},
+                ),
+            ]
+        )
+    )
+    server.listen(port, listen)
+    try:
+        async with running(application):
+            await application.bot.set_webhook(
+                webhook_url, allowed_updates=Update.ALL_TYPES
+            )
+            logging.info("Приём вебхуков запущен на %s:%s", listen, port)
+            await wait_for_stop_signal()
+    finally:
+        server.stop()
+        await server.close_all_connections()
+
+
+def run_single(build_application, listen, port, url_path, webhook_url):
+    asyncio.run(serve_single(build_application, listen, port, url_path, webhook_url))
+
+
+def run_cluster(build_application, workers, token, listen, port, url_path, webhook_url):
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=worker_queue_size) for _ in range(workers)]
+    snapshots = context.Queue()
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(index, updates, snapshots, build_application),
+            name=f"bot-worker-{index}",
+        )
+        for index, updates in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(
+            serve_ingress(
+                token,
+                queues,
+                processes,
+                snapshots,
+                listen,
+                port,
+                url_path,
+                webhook_url,
+            )
+        )
+    finally:
+        for updates, process in zip(queues, processes):
+            if not process.is_alive():
+                continue
+            try:
+                updates.put(None, timeout=worker_shutdown_timeout)
+            except queue.Full:
+                logging.error("Не удалось остановить воркер %s", process.name)
+        for process in processes:
+            process.join(worker_shutdown_timeout)
+            if process.is_alive():
+                logging.error("Воркер %s не остановился вовремя", process.name)
+                process.terminate()
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class TTLCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._items.get(key, _missing)
+        if item is not _missing:
+            value, expires_at = item
+            if expires_at > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._items[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        self._items[key] = (value, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,32 @@
+import logging
+from types import MappingProxyType
+
+from database.services import fetch_categories
+
+
+class CategoryRegistry:
+    def __init__(self):
+        self.categories = ()
+        self.by_alias = MappingProxyType({})
+        self.by_id = MappingProxyType({})
+        self.by_title = MappingProxyType({})
+
+    async def load(self):
+        categories = tuple(await fetch_categories())
+        self.by_alias = MappingProxyType(
+            {category.alias: category for category in categories}
+        )
+        self.by_id = MappingProxyType(
+            {category.id: category for category in categories}
+        )
+        self.by_title = MappingProxyType(
+            {category.title.casefold(): category for category in categories}
+        )
+        self.categories = categories
+        logging.info("Загружено категорий: %s", len(categories))
+
+    def has_alias(self, alias):
+        return alias in self.by_alias
+
+
+category_registry = CategoryRegistry()
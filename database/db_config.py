@@ -1,13 +1,31 @@
+import asyncio
 import os
 
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from database.entities import Base
+from metrics import metrics
 
-engine = create_async_engine(os.getenv("DB_CONNECTION_STRING"), echo=True)
+engine = create_async_engine(
+    os.getenv("DB_CONNECTION_STRING"), echo=os.getenv("DB_ECHO") == "1"
+)
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
-async def database_init():
-    async with engine.begin() as connection:
-        await connection.run_sync(Base.metadata.create_all)
+async def warm_pool(size):
+    connections = await asyncio.gather(*(engine.connect().start() for _ in range(size)))
+    for connection in connections:
+        await connection.close()
+
+
+def pool_samples():
+    pool = engine.pool
+    for name, value in (
+        ("db_pool_size", pool.size()),
+        ("db_pool_checked_in", pool.checkedin()),
+        ("db_pool_checked_out", pool.checkedout()),
+        ("db_pool_overflow", pool.overflow()),
+    ):
+        yield name, "gauge", name, (), value
+
+
+metrics.add_collector(pool_samples)
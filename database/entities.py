@@ -8,8 +8,13 @@ from sqlalchemy import (
     BigInteger,
     DateTime,
     Boolean,
+    Computed,
     ForeignKey,
+    Index,
+    LargeBinary,
+    text,
 )
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, mapped_column, Mapped, relationship
 
@@ -20,6 +25,7 @@ class Base(AsyncAttrs, DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (Index("ix_users_telegram_id", "telegram_id", unique=True),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     first_name: Mapped[str] = mapped_column(String(length=255), nullable=True)
     last_name: Mapped[str] = mapped_column(String(length=255), nullable=True)
@@ -43,6 +49,28 @@ class AdCategory(Base):
 
 class Ad(Base):
     __tablename__ = "ads"
+    __table_args__ = (
+        Index(
+            "ix_ads_pending_moderation",
+            "id",
+            postgresql_where=text("is_valid IS false AND is_rejected IS false"),
+        ),
+        Index(
+            "ix_ads_published_by_user",
+            "user_id",
+            "id",
+            postgresql_where=text("is_published"),
+        ),
+        Index("ix_ads_user_id", "user_id"),
+        Index("ix_ads_category_id", "category_id"),
+        Index("ix_ads_expires_from", text("COALESCE(published_at, created_at)"), "id"),
+        Index(
+            "ix_ads_search_vector",
+            "search_vector",
+            postgresql_using="gin",
+            postgresql_where=text("is_published"),
+        ),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(length=255), nullable=False)
     description: Mapped[str] = mapped_column(String(length=1000), nullable=False)
@@ -50,27 +78,96 @@ class Ad(Base):
     is_valid: Mapped[bool] = mapped_column(Boolean, default=False)
     is_rejected: Mapped[bool] = mapped_column(Boolean, default=False)
     is_published: Mapped[bool] = mapped_column(Boolean, default=False)
+    claimed_by: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    claimed_until: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.now
+    )
+    published_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(description, '')), 'B')",
+            persisted=True,
+        ),
+    )
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
-    user: Mapped["User"] = relationship(back_populates="ads", lazy="joined")
+    user: Mapped["User"] = relationship(back_populates="ads")
     category_id: Mapped[int] = mapped_column(
         ForeignKey("ad_categories.id"), nullable=True
     )
-    category: Mapped["AdCategory"] = relationship(back_populates="ads", lazy="joined")
-    images: Mapped[List["Image"]] = relationship(lazy="joined")
-    messages: Mapped[List["MessageId"]] = relationship(lazy="joined")
+    category: Mapped["AdCategory"] = relationship(back_populates="ads")
+    images: Mapped[List["Image"]] = relationship()
+    messages: Mapped[List["MessageId"]] = relationship()
+
+
+class ArchivedAd(Base):
+    __tablename__ = "ads_archive"
+    __table_args__ = (Index("ix_ads_archive_user_id", "user_id"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    title: Mapped[str] = mapped_column(String(length=255), nullable=False)
+    description: Mapped[str] = mapped_column(String(length=1000), nullable=False)
+    cost: Mapped[int] = mapped_column(Integer, nullable=False)
+    is_valid: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    is_rejected: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    is_published: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    category_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    media_id: Mapped[str] = mapped_column(String(length=300), nullable=True)
+    image_ids: Mapped[List[str]] = mapped_column(ARRAY(String(length=300)))
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    published_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
 
 
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (
+        Index("ix_images_ad_id", "ad_id"),
+        Index("ix_images_media_id", "media_id"),
+        Index("ix_images_image_id", "image_id"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     image_id: Mapped[str] = mapped_column(String(length=300), nullable=True)
     media_id: Mapped[str] = mapped_column(String(length=300), nullable=True)
     ad_id: Mapped[int] = mapped_column(ForeignKey("ads.id"), nullable=True)
-    ad: Mapped["Ad"] = relationship(back_populates="images", lazy="joined")
+    ad: Mapped["Ad"] = relationship(back_populates="images")
 
 
 class MessageId(Base):
     __tablename__ = "message_ids"
+    __table_args__ = (Index("ix_message_ids_ad_id", "ad_id"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     message_id: Mapped[int] = mapped_column(Integer, nullable=False)
     ad_id: Mapped[int] = mapped_column(ForeignKey("ads.id"), nullable=True)
+
+
+class PersistenceEntry(Base):
+    __tablename__ = "bot_persistence"
+    namespace: Mapped[str] = mapped_column(String(length=255), primary_key=True)
+    key: Mapped[str] = mapped_column(String(length=255), primary_key=True)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class PublishJob(Base):
+    __tablename__ = "publish_jobs"
+    __table_args__ = (
+        Index(
+            "ix_publish_jobs_pending",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ad_id: Mapped[int] = mapped_column(
+        ForeignKey("ads.id"), nullable=False, unique=True
+    )
+    status: Mapped[str] = mapped_column(String(length=16), nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    locked_until: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str] = mapped_column(String(length=1000), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    published_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
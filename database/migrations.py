@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+
+from sqlalchemy import text
+
+from database.db_config import engine
+
+auto_migrate = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+migrations_lock_key = 7_406_310_001
+
+schema_migrations_table = """
+    CREATE TABLE IF NOT EXISTS public.schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+    )
+"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    statements: tuple
+
+
+migrations = (
+    Migration(
+        1,
+        "baseline",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS public.users (
+                id SERIAL PRIMARY KEY,
+                first_name VARCHAR(255),
+                last_name VARCHAR(255),
+                phone VARCHAR(255),
+                telegram_id BIGINT NOT NULL,
+                telegram_login VARCHAR(255),
+                register_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                last_login TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                is_admin BOOLEAN NOT NULL,
+                is_blocked BOOLEAN NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.ad_categories (
+                id SERIAL PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                alias VARCHAR(255) NOT NULL
+            )
+            """,
+            """
+            INSERT INTO public.ad_categories (title, alias)
+            SELECT title, alias FROM (
+                VALUES
+                    ('Жилье', 'home_category_callback'),
+                    ('Работа', 'work_category_callback'),
+                    ('Товары', 'goods_category_callback'),
+                    ('Услуги', 'services_category_callback')
+            ) AS categories (title, alias)
+            WHERE NOT EXISTS (SELECT 1 FROM public.ad_categories)
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.ads (
+                id SERIAL PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                description VARCHAR(1000) NOT NULL,
+                cost INTEGER NOT NULL,
+                is_valid BOOLEAN NOT NULL,
+                is_rejected BOOLEAN NOT NULL,
+                is_published BOOLEAN NOT NULL,
+                user_id INTEGER NOT NULL REFERENCES public.users (id),
+                category_id INTEGER REFERENCES public.ad_categories (id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.images (
+                id SERIAL PRIMARY KEY,
+                image_id VARCHAR(300),
+                media_id VARCHAR(300),
+                ad_id INTEGER REFERENCES public.ads (id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.message_ids (
+                id SERIAL PRIMARY KEY,
+                message_id INTEGER NOT NULL,
+                ad_id INTEGER REFERENCES public.ads (id)
+            )
+            """,
+        ),
+    ),
+    Migration(
+        2,
+        "ads_moderation_claims",
+        (
+            "ALTER TABLE public.ads ADD COLUMN IF NOT EXISTS claimed_by BIGINT",
+            "ALTER TABLE public.ads "
+            "ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP WITHOUT TIME ZONE",
+        ),
+    ),
+    Migration(
+        3,
+        "hot_query_indexes",
+        (
+            """
+            UPDATE public.users SET
+                is_admin = merged.is_admin,
+                is_blocked = merged.is_blocked,
+                phone = COALESCE(users.phone, merged.phone)
+            FROM (
+                SELECT min(id) AS id, bool_or(is_admin) AS is_admin,
+                    bool_or(is_blocked) AS is_blocked, max(phone) AS phone
+                FROM public.users GROUP BY telegram_id HAVING count(*) > 1
+            ) AS merged
+            WHERE users.id = merged.id
+            """,
+            """
+            UPDATE public.ads SET user_id = duplicates.keep_id
+            FROM (
+                SELECT id, min(id) OVER (PARTITION BY telegram_id) AS keep_id
+                FROM public.users
+            ) AS duplicates
+            WHERE ads.user_id = duplicates.id AND duplicates.id <> duplicates.keep_id
+            """,
+            """
+            DELETE FROM public.users USING public.users AS kept
+            WHERE users.telegram_id = kept.telegram_id AND users.id > kept.id
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_telegram_id "
+            "ON public.users (telegram_id)",
+            "CREATE INDEX IF NOT EXISTS ix_ads_pending_moderation ON public.ads (id) "
+            "WHERE is_valid IS false AND is_rejected IS false",
+            "CREATE INDEX IF NOT EXISTS ix_ads_published_by_user "
+            "ON public.ads (user_id, id) WHERE is_published",
+            "CREATE INDEX IF NOT EXISTS ix_ads_user_id ON public.ads (user_id)",
+            "CREATE INDEX IF NOT EXISTS ix_ads_category_id ON public.ads (category_id)",
+            "CREATE INDEX IF NOT EXISTS ix_images_ad_id ON public.images (ad_id)",
+            "CREATE INDEX IF NOT EXISTS ix_images_media_id ON public.images (media_id)",
+            "CREATE INDEX IF NOT EXISTS ix_images_image_id ON public.images (image_id)",
+            "CREATE INDEX IF NOT EXISTS ix_message_ids_ad_id "
+            "ON public.message_ids (ad_id)",
+        ),
+    ),
+    Migration(
+        4,
+        "bot_persistence",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS public.bot_persistence (
+                namespace VARCHAR(255) NOT NULL,
+                key VARCHAR(255) NOT NULL,
+                data BYTEA NOT NULL,
+                updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """,
+        ),
+    ),
+    Migration(
+        5,
+        "publish_outbox",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS public.publish_jobs (
+                id SERIAL PRIMARY KEY,
+                ad_id INTEGER NOT NULL UNIQUE REFERENCES public.ads (id),
+                status VARCHAR(16) NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                locked_until TIMESTAMP WITHOUT TIME ZONE,
+                last_error VARCHAR(1000),
+                created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                published_at TIMESTAMP WITHOUT TIME ZONE
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_publish_jobs_pending "
+            "ON public.publish_jobs (next_attempt_at) WHERE status = 'pending'",
+        ),
+    ),
+    Migration(
+        6,
+        "ads_expiry_archive",
+        (
+            "ALTER TABLE public.ads ADD COLUMN IF NOT EXISTS "
+            "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()",
+            "CREATE INDEX IF NOT EXISTS ix_ads_created_at "
+            "ON public.ads (created_at, id)",
+            """
+            CREATE TABLE IF NOT EXISTS public.ads_archive (
+                id INTEGER PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                description VARCHAR(1000) NOT NULL,
+                cost INTEGER NOT NULL,
+                is_valid BOOLEAN NOT NULL,
+                is_rejected BOOLEAN NOT NULL,
+                is_published BOOLEAN NOT NULL,
+                user_id INTEGER NOT NULL,
+                category_id INTEGER,
+                media_id VARCHAR(300),
+                image_ids VARCHAR(300)[],
+                created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                archived_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_ads_archive_user_id "
+            "ON public.ads_archive (user_id)",
+        ),
+    ),
+    Migration(
+        7,
+        "ads_full_text_search",
+        (
+            "ALTER TABLE public.ads ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(description, '')), 'B')"
+            ") STORED",
+            "CREATE INDEX IF NOT EXISTS ix_ads_search_vector "
+            "ON public.ads USING gin (search_vector) WHERE is_published",
+        ),
+    ),
+    Migration(
+        8,
+        "ads_published_at",
+        (
+            "ALTER TABLE public.ads ADD COLUMN IF NOT EXISTS "
+            "published_at TIMESTAMP WITHOUT TIME ZONE",
+            """
+            UPDATE public.ads SET published_at = publish_jobs.published_at
+            FROM public.publish_jobs
+            WHERE publish_jobs.ad_id = ads.id AND ads.is_published
+                AND ads.published_at IS NULL
+            """,
+            "ALTER TABLE public.ads_archive ADD COLUMN IF NOT EXISTS "
+            "published_at TIMESTAMP WITHOUT TIME ZONE",
+            "CREATE INDEX IF NOT EXISTS ix_ads_expires_from "
+            "ON public.ads ((COALESCE(published_at, created_at)), id)",
+            "DROP INDEX IF EXISTS public.ix_ads_created_at",
+        ),
+    ),
+)
+
+latest_version = migrations[-1].version
+
+
+async def fetch_schema_version(connection):
+    table = await connection.scalar(
+        text("SELECT to_regclass('public.schema_migrations')")
+    )
+    if table is None:
+        return 0
+    version = await connection.scalar(
+        text("SELECT max(version) FROM public.schema_migrations")
+    )
+    return version or 0
+
+
+async def migrate():
+    async with engine.begin() as connection:
+        await connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": migrations_lock_key}
+        )
+        await connection.execute(text(schema_migrations_table))
+        current_version = await fetch_schema_version(connection)
+        for migration in migrations:
+            if migration.version <= current_version:
+                continue
+            logging.info(
+                "Применение миграции %s: %s", migration.version, migration.name
+            )
+            for statement in migration.statements:
+                await connection.execute(text(statement))
+            await connection.execute(
+                text(
+                    "INSERT INTO public.schema_migrations (version, name) "
+                    "VALUES (:version, :name)"
+                ),
+                {"version": migration.version, "name": migration.name},
+            )
+        return max(current_version, latest_version)
+
+
+async def database_init():
+    async with engine.connect() as connection:
+        version = await fetch_schema_version(connection)
+    if version == latest_version:
+        return version
+    if version > latest_version:
+        raise RuntimeError(
+            f"Версия схемы БД {version} новее поддерживаемой {latest_version}"
+        )
+    if not auto_migrate:
+        raise RuntimeError(
+            f"Схема БД устарела: версия {version}, требуется {latest_version}. "
+            "Запустите python -m database.migrations"
+        )
+    return await migrate()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
@@ -1,3 +1,4 @@
+from datetime import datetime
 from dataclasses import dataclass
 
 
@@ -20,6 +21,14 @@ class CreateAdRequest:
     category_title: str
     category_id: int
     media_id: int
+    image_ids: [str]
+
+
+@dataclass(frozen=True)
+class Category:
+    id: int
+    title: str
+    alias: str
 
 
 @dataclass
@@ -40,3 +49,39 @@ class AdResponse:
             f"<b>Категория:</b> #{self.category}\n"
             f"<b>Продавец:</b> @{self.user_telegram}"
         )
+
+
+@dataclass
+class AdDetails(AdResponse):
+    user_telegram_id: int
+    is_published: bool
+    message_ids: [int]
+
+
+@dataclass
+class AdsPage:
+    ads: [AdResponse]
+    previous_before_id: int
+    next_after_id: int
+
+
+@dataclass
+class PublishTask:
+    job_id: int
+    attempts: int
+    locked_until: datetime
+    ad: AdDetails
+
+
+@dataclass
+class SearchQuery:
+    terms: [str]
+    category_id: int = None
+    min_cost: int = None
+    max_cost: int = None
+
+
+@dataclass
+class SearchPage:
+    ads: [AdResponse]
+    next_offset: int
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+from contextlib import suppress
+from datetime import datetime
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as insert_or_update
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database.db_config import async_session
+from database.entities import PersistenceEntry
+
+persistence_update_interval = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", 10))
+persistence_flush_delay = float(os.getenv("PERSISTENCE_FLUSH_DELAY", 1))
+
+user_data_namespace = "user_data"
+chat_data_namespace = "chat_data"
+bot_data_namespace = "bot_data"
+callback_data_namespace = "callback_data"
+conversation_namespace = "conversation:{}"
+
+
+class DatabasePersistence(BasePersistence):
+    def __init__(self, update_interval=persistence_update_interval):
+        super().__init__(store_data=PersistenceInput(), update_interval=update_interval)
+        self._stored = {}
+        self._versions = {}
+        self._dirty = {}
+        self._in_flight = {}
+        self._flush_task = None
+
+    async def _load(self, namespace):
+        async with async_session() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(
+                        PersistenceEntry.key,
+                        PersistenceEntry.data,
+                        PersistenceEntry.updated_at,
+                    ).where(PersistenceEntry.namespace == namespace)
+                )
+                rows = result.all()
+        versions = self._versions.setdefault(namespace, {})
+        loaded = {}
+        for key, data, updated_at in rows:
+            self._stored[(namespace, key)] = data
+            versions[key] = updated_at
+            loaded[key] = pickle.loads(data)
+        return loaded
+
+    def _pending(self, namespace, key):
+        entry = (namespace, key)
+        return entry in self._dirty or entry in self._in_flight
+
+    async def _refresh(self, namespace, key=None):
+        filters = [PersistenceEntry.namespace == namespace]
+        if key is not None:
+            filters.append(PersistenceEntry.key == key)
+        async with async_session() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(PersistenceEntry.key, PersistenceEntry.updated_at).where(
+                        *filters
+                    )
+                )
+                current = dict(result.all())
+                known = self._versions.setdefault(namespace, {})
+                changed = [
+                    changed_key
+                    for changed_key, updated_at in current.items()
+                    if known.get(changed_key) != updated_at
+                    and not self._pending(namespace, changed_key)
+                ]
+                rows = []
+                if changed:
+                    result = await session.execute(
+                        select(PersistenceEntry.key, PersistenceEntry.data).where(
+                            PersistenceEntry.namespace == namespace,
+                            PersistenceEntry.key.in_(changed),
+                        )
+                    )
+                    rows = result.all()
+        removed = [
+            removed_key
+            for removed_key in ([key] if key is not None else list(known))
+            if removed_key in known
+            and removed_key not in current
+            and not self._pending(namespace, removed_key)
+        ]
+        for removed_key in removed:
+            del known[removed_key]
+            self._stored.pop((namespace, removed_key), None)
+        refreshed = {}
+        for changed_key, data in rows:
+            if self._pending(namespace, changed_key):
+                continue
+            self._stored[(namespace, changed_key)] = data
+            known[changed_key] = current[changed_key]
+            refreshed[changed_key] = pickle.loads(data)
+        return refreshed, removed
+
+    async def _refresh_entry(self, namespace, key, value):
+        refreshed, removed = await self._refresh(namespace, key)
+        if key in refreshed or removed:
+            value.clear()
+            value.update(refreshed.get(key, {}))
+
+    def _stage(self, namespace, key, value):
+        data = None if value is None else pickle.dumps(value)
+        entry = (namespace, key)
+        latest = (
+            self._in_flight[entry]
+            if entry in self._in_flight
+            else self._stored.get(entry)
+        )
+        if latest == data:
+            self._dirty.pop(entry, None)
+            return
+        self._dirty[entry] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(persistence_flush_delay)
+        while self._dirty and await self._write():
+            pass
+
+    async def _write(self):
+        if not self._dirty:
+            return True
+        dirty, self._dirty = self._dirty, {}
+        self._in_flight = dirty
+        now = datetime.now()
+        upserts = [
+            {"namespace": namespace, "key": key, "data": data, "updated_at": now}
+            for (namespace, key), data in dirty.items()
+            if data is not None
+        ]
+        deletes = [entry for entry, data in dirty.items() if data is None]
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    if upserts:
+                        statement = insert_or_update(PersistenceEntry.__table__)
+                        await session.execute(
+                            statement.on_conflict_do_update(
+                                index_elements=["namespace", "key"],
+                                set_={
+                                    "data": statement.excluded.data,
+                                    "updated_at": statement.excluded.updated_at,
+                                },
+                            ),
+                            upserts,
+                        )
+                    if deletes:
+                        await session.execute(
+                            delete(PersistenceEntry).where(
+                                tuple_(
+                                    PersistenceEntry.namespace, PersistenceEntry.key
+                                ).in_(deletes)
+                            )
+                        )
+        except asyncio.CancelledError:
+            self._restore(dirty)
+            raise
+        except Exception:
+            logging.exception("Не удалось сохранить состояние бота в БД")
+            self._restore(dirty)
+            return False
+        finally:
+            self._in_flight = {}
+        for (namespace, key), data in dirty.items():
+            versions = self._versions.setdefault(namespace, {})
+            if data is None:
+                self._stored.pop((namespace, key), None)
+                versions.pop(key, None)
+            else:
+                self._stored[(namespace, key)] = data
+                versions[key] = now
+        return True
+
+    def _restore(self, dirty):
+        for entry, data in dirty.items():
+            self._dirty.setdefault(entry, data)
+
+    async def get_user_data(self):
+        data = await self._load(user_data_namespace)
+        return {int(user_id): value for user_id, value in data.items()}
+
+    async def get_chat_data(self):
+        data = await self._load(chat_data_namespace)
+        return {int(chat_id): value for chat_id, value in data.items()}
+
+    async def get_bot_data(self):
+        data = await self._load(bot_data_namespace)
+        bot_data = data.pop(bot_data_namespace, {})
+        if bot_data:
+            self._stage(bot_data_namespace, bot_data_namespace, None)
+            for key, value in bot_data.items():
+                self._stage(bot_data_namespace, json.dumps(key), value)
+        bot_data.update((json.loads(key), value) for key, value in data.items())
+        return bot_data
+
+    async def get_callback_data(self):
+        data = await self._load(callback_data_namespace)
+        return data.get(callback_data_namespace)
+
+    async def get_conversations(self, name):
+        data = await self._load(conversation_namespace.format(name))
+        return {tuple(json.loads(key)): state for key, state in data.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(conversation_namespace.format(name), json.dumps(key), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._stage(user_data_namespace, str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage(chat_data_namespace, str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        keys = {json.dumps(key): value for key, value in data.items()}
+        for key, value in keys.items():
+            self._stage(bot_data_namespace, key, value)
+        stored = self._versions.get(bot_data_namespace, {})
+        dirty = [
+            key for namespace, key in self._dirty if namespace == bot_data_namespace
+        ]
+        for key in set(stored).union(dirty).difference(keys):
+            self._stage(bot_data_namespace, key, None)
+
+    async def update_callback_data(self, data):
+        self._stage(callback_data_namespace, callback_data_namespace, data)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage(chat_data_namespace, str(chat_id), None)
+
+    async def drop_user_data(self, user_id):
+        self._stage(user_data_namespace, str(user_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh_entry(user_data_namespace, str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh_entry(chat_data_namespace, str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        refreshed, removed = await self._refresh(bot_data_namespace)
+        refreshed.pop(bot_data_namespace, None)
+        for key in removed:
+            if key != bot_data_namespace:
+                bot_data.pop(json.loads(key), None)
+        bot_data.update((json.loads(key), value) for key, value in refreshed.items())
+
+    async def flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flush_task
+        await self._write()
@@ -0,0 +1,211 @@
+import contextlib
+import heapq
+import logging
+import os
+import re
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from database.db_config import engine
+from metrics import metrics
+
+profiler_enabled = os.getenv("QUERY_PROFILER", "1") == "1"
+slow_query_ms = float(os.getenv("QUERY_SLOW_MS", 200))
+n_plus_one_threshold = int(os.getenv("QUERY_N_PLUS_ONE_THRESHOLD", 5))
+top_queries_size = int(os.getenv("QUERY_TOP_N", 20))
+top_window_seconds = int(os.getenv("QUERY_TOP_WINDOW_SECONDS", 300))
+top_window_slots = 5
+tracked_statements_limit = 1000
+statement_label_length = 200
+
+placeholders_pattern = re.compile(
+    r"(?:\$\d+|%\(\w+\)s|%s|\?)(?:\s*,\s*(?:\$\d+|%\(\w+\)s|%s|\?))+"
+)
+whitespace_pattern = re.compile(r"\s+")
+
+current_scope = ContextVar("query_profiler_scope", default=None)
+
+
+def normalize_statement(statement):
+    statement = whitespace_pattern.sub(" ", statement).strip()
+    return placeholders_pattern.sub("…", statement)
+
+
+def redact_parameters(parameters, executemany=False):
+    if executemany:
+        return f"<{len(parameters)} строк>"
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class QueryStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, count, total, maximum):
+        self.count += count
+        self.total += total
+        self.max = max(self.max, maximum)
+
+
+class QueryProfiler:
+    def __init__(self, engine):
+        self.engines = [engine.sync_engine]
+        self.enabled = False
+        self.slot_seconds = top_window_seconds / top_window_slots
+        self.slots = deque(maxlen=top_window_slots)
+        self.slow_queries = 0
+        self.n_plus_one = 0
+
+    def _listen(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def attach(self, engine):
+        self.engines.append(engine.sync_engine)
+        if self.enabled:
+            self._listen(engine.sync_engine)
+
+    def enable(self):
+        if not self.enabled:
+            for tracked_engine in self.engines:
+                self._listen(tracked_engine)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            for tracked_engine in self.engines:
+                event.remove(tracked_engine, "before_cursor_execute", self._before)
+                event.remove(tracked_engine, "after_cursor_execute", self._after)
+            self.enabled = False
+
+    def reset(self):
+        self.slots.clear()
+        self.slow_queries = 0
+        self.n_plus_one = 0
+
+    def _before(self, connection, cursor, statement, parameters, context, many):
+        context.profiler_started = time.perf_counter()
+
+    def _after(self, connection, cursor, statement, parameters, context, many):
+        started = getattr(context, "profiler_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        key = normalize_statement(statement)
+        queries = self._current_slot()
+        stats = queries.get(key)
+        if stats is None and len(queries) < tracked_statements_limit:
+            stats = queries[key] = QueryStats()
+        if stats is not None:
+            stats.add(1, elapsed, elapsed)
+        scope = current_scope.get()
+        if scope is not None:
+            scope[key] += 1
+        if elapsed * 1000 >= slow_query_ms:
+            self.slow_queries += 1
+            logging.warning(
+                "Медленный запрос %.1f мс: %s; параметры: %s",
+                elapsed * 1000,
+                key,
+                redact_parameters(parameters, many),
+            )
+
+    @contextlib.contextmanager
+    def scope(self, name):
+        if not self.enabled:
+            yield
+            return
+        statements = Counter()
+        token = current_scope.set(statements)
+        try:
+            yield
+        finally:
+            current_scope.reset(token)
+            metrics.inc(
+                "db_statements_total", (("update", name),), sum(statements.values())
+            )
+            metrics.inc("db_profiled_updates_total", (("update", name),))
+            for statement, count in statements.items():
+                if count >= n_plus_one_threshold:
+                    self.n_plus_one += 1
+                    logging.warning(
+                        "Возможный N+1 при обработке %s: %s раз %s",
+                        name,
+                        count,
+                        statement,
+                    )
+
+    def _current_slot(self):
+        slot = int(time.monotonic() // self.slot_seconds)
+        if not self.slots or self.slots[-1][0] != slot:
+            self.slots.append((slot, {}))
+        return self.slots[-1][1]
+
+    def top(self, size=top_queries_size):
+        oldest = int(time.monotonic() // self.slot_seconds) - top_window_slots
+        merged = {}
+        for slot, queries in self.slots:
+            if slot <= oldest:
+                continue
+            for statement, stats in queries.items():
+                total = merged.get(statement)
+                if total is None:
+                    total = merged[statement] = QueryStats()
+                total.add(stats.count, stats.total, stats.max)
+        return heapq.nlargest(size, merged.items(), key=lambda item: item[1].total)
+
+    def samples(self):
+        yield (
+            "db_profiler_enabled",
+            "gauge",
+            "db_profiler_enabled",
+            (),
+            int(self.enabled),
+        )
+        yield (
+            "db_slow_queries_total",
+            "counter",
+            "db_slow_queries_total",
+            (),
+            self.slow_queries,
+        )
+        yield (
+            "db_n_plus_one_total",
+            "counter",
+            "db_n_plus_one_total",
+            (),
+            self.n_plus_one,
+        )
+        for statement, stats in self.top():
+            labels = (("statement", statement[:statement_label_length]),)
+            yield (
+                "db_query_window_seconds",
+                "gauge",
+                "db_query_window_seconds",
+                labels,
+                stats.total,
+            )
+            yield (
+                "db_query_window_calls",
+                "gauge",
+                "db_query_window_calls",
+                labels,
+                stats.count,
+            )
+
+
+query_profiler = QueryProfiler(engine)
+metrics.add_collector(query_profiler.samples)
+if profiler_enabled:
+    query_profiler.enable()
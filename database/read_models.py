@@ -0,0 +1,76 @@
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from database.entities import Ad, AdCategory, Image, MessageId, User
+from database.models import AdDetails, AdResponse
+
+ad_image_ids = (
+    select(func.array_agg(aggregate_order_by(Image.image_id, Image.id)))
+    .where(Image.ad_id == Ad.id)
+    .where(Image.image_id.is_not(None))
+    .correlate(Ad)
+    .scalar_subquery()
+)
+
+ad_message_ids = (
+    select(func.array_agg(aggregate_order_by(MessageId.message_id, MessageId.id)))
+    .where(MessageId.ad_id == Ad.id)
+    .correlate(Ad)
+    .scalar_subquery()
+)
+
+
+def select_ad_responses():
+    return (
+        select(
+            Ad.id,
+            Ad.title,
+            User.telegram_login,
+            Ad.description,
+            Ad.cost,
+            AdCategory.title,
+            ad_image_ids,
+        )
+        .join(User, Ad.user_id == User.id)
+        .outerjoin(AdCategory, Ad.category_id == AdCategory.id)
+    )
+
+
+def select_ad_details():
+    return select_ad_responses().add_columns(
+        User.telegram_id, Ad.is_published, ad_message_ids
+    )
+
+
+def to_ad_response(row):
+    ad_id, title, user_telegram, description, cost, category, image_ids = row
+    return AdResponse(
+        ad_id, title, user_telegram, description, cost, category, image_ids or []
+    )
+
+
+def to_ad_details(row):
+    (
+        ad_id,
+        title,
+        user_telegram,
+        description,
+        cost,
+        category,
+        image_ids,
+        user_telegram_id,
+        is_published,
+        message_ids,
+    ) = row
+    return AdDetails(
+        ad_id,
+        title,
+        user_telegram,
+        description,
+        cost,
+        category,
+        image_ids or [],
+        user_telegram_id,
+        is_published,
+        message_ids or [],
+    )
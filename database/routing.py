@@ -0,0 +1,169 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database.profiler import query_profiler
+from database.unit_of_work import primary_session, track_engine
+from metrics import metrics
+
+replica_connection_strings = [
+    url.strip()
+    for url in os.getenv("DB_REPLICA_CONNECTION_STRINGS", "").split(",")
+    if url.strip()
+]
+replica_max_lag_seconds = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", 5))
+replica_health_interval = int(os.getenv("DB_REPLICA_HEALTH_INTERVAL", 5))
+replica_health_timeout = float(os.getenv("DB_REPLICA_HEALTH_TIMEOUT", 2))
+read_your_writes_seconds = float(
+    os.getenv("DB_READ_YOUR_WRITES_SECONDS", replica_max_lag_seconds * 2)
+)
+recent_writers_limit = 100000
+
+replica_lag_statement = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+    """)
+
+current_user = ContextVar("database_current_user", default=None)
+
+
+class Replica:
+    def __init__(self, url):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = create_async_engine(url, pool_pre_ping=True)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.healthy = False
+        self.lag = None
+        track_engine(self.engine)
+        query_profiler.attach(self.engine)
+        event.listen(self.engine.sync_engine, "handle_error", self._handle_error)
+
+    def _handle_error(self, context):
+        if context.is_disconnect and self.healthy:
+            self.healthy = False
+            logging.warning(
+                "Реплика %s недоступна: %s", self.name, context.original_exception
+            )
+
+    async def check(self):
+        try:
+            async with self.engine.connect() as connection:
+                lag = await asyncio.wait_for(
+                    connection.scalar(replica_lag_statement), replica_health_timeout
+                )
+        except Exception as error:
+            self.lag = None
+            if self.healthy:
+                logging.warning("Реплика %s недоступна: %s", self.name, error)
+            self.healthy = False
+            return
+        self.lag = float(lag)
+        healthy = self.lag <= replica_max_lag_seconds
+        if healthy != self.healthy:
+            logging.warning(
+                "Реплика %s %s, отставание %.1f с",
+                self.name,
+                "снова в работе" if healthy else "выведена из чтения",
+                self.lag,
+            )
+        self.healthy = healthy
+
+    def load(self):
+        return self.engine.pool.checkedout()
+
+
+class SessionRouter:
+    def __init__(self, primary, replica_urls):
+        self.primary = primary
+        self.replicas = [Replica(url) for url in replica_urls]
+        self.recent_writers = OrderedDict()
+        self.rotation = itertools.count()
+        self.reads = Counter()
+
+    def write(self):
+        user_id = current_user.get()
+        if user_id is not None:
+            self.recent_writers.pop(user_id, None)
+            self.recent_writers[user_id] = time.monotonic() + read_your_writes_seconds
+            if len(self.recent_writers) > recent_writers_limit:
+                self.recent_writers.popitem(last=False)
+        return self.primary()
+
+    def read(self, user_id=None):
+        if user_id is None:
+            user_id = current_user.get()
+        if user_id is not None and self._wrote_recently(user_id):
+            self.reads["read_your_writes"] += 1
+            return self.primary()
+        replica = self._choose_replica()
+        if replica is None:
+            self.reads["primary"] += 1
+            return self.primary()
+        self.reads["replica"] += 1
+        return replica.session()
+
+    def _wrote_recently(self, user_id):
+        now = time.monotonic()
+        while self.recent_writers:
+            oldest, deadline = next(iter(self.recent_writers.items()))
+            if deadline > now:
+                break
+            del self.recent_writers[oldest]
+        return user_id in self.recent_writers
+
+    def _choose_replica(self):
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        start = next(self.rotation) % len(healthy)
+        rotated = healthy[start:] + healthy[:start]
+        return min(rotated, key=Replica.load)
+
+    async def check_replicas(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def dispose(self):
+        await asyncio.gather(*(replica.engine.dispose() for replica in self.replicas))
+
+    def samples(self):
+        for target, count in self.reads.items():
+            yield (
+                "db_reads_total",
+                "counter",
+                "db_reads_total",
+                (("target", target),),
+                count,
+            )
+        for replica in self.replicas:
+            labels = (("replica", replica.name),)
+            yield (
+                "db_replica_healthy",
+                "gauge",
+                "db_replica_healthy",
+                labels,
+                int(replica.healthy),
+            )
+            if replica.lag is not None:
+                yield (
+                    "db_replica_lag_seconds",
+                    "gauge",
+                    "db_replica_lag_seconds",
+                    labels,
+                    replica.lag,
+                )
+
+
+session_router = SessionRouter(primary_session, replica_connection_strings)
+metrics.add_collector(session_router.samples)
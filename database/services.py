@@ -1,190 +1,523 @@
-from datetime import datetime
+import logging
+import os
+from datetime import datetime, timedelta
 
-from sqlalchemy import select, insert, update
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select, insert, update, delete, or_, text, func, literal_column
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import insert as insert_or_update
 
-from database.db_config import async_session
-from database.entities import User, Ad, AdCategory, Image, MessageId
-from database.models import CreateAdRequest, AdResponse, CreateUserRequest
+from database.cache import TTLCache
+from database.entities import User, Ad, AdCategory, MessageId, PublishJob
+from database.models import (
+    CreateAdRequest,
+    AdResponse,
+    CreateUserRequest,
+    AdsPage,
+    Category,
+    PublishTask,
+    SearchQuery,
+    SearchPage,
+)
+from database.read_models import (
+    select_ad_details,
+    select_ad_responses,
+    to_ad_details,
+    to_ad_response,
+)
+from database.routing import session_router
+from database.unit_of_work import after_commit, primary_session
+from metrics import metrics
+
+read_session = session_router.read
+write_session = session_router.write
+
+ads_page_size = int(os.getenv("ADS_PAGE_SIZE", 5))
+moderation_batch_size = int(os.getenv("MODERATION_BATCH_SIZE", 5))
+moderation_lease_seconds = int(os.getenv("MODERATION_LEASE_SECONDS", 600))
+search_page_size = int(os.getenv("INLINE_SEARCH_PAGE_SIZE", 20))
+search_statement_timeout_ms = int(os.getenv("INLINE_SEARCH_STATEMENT_TIMEOUT_MS", 2000))
+search_config = literal_column("'russian'")
+ad_ttl_days = int(os.getenv("AD_TTL_DAYS", 30))
+ad_expiry_batch_size = int(os.getenv("AD_EXPIRY_BATCH_SIZE", 500))
+publish_batch_size = int(os.getenv("PUBLISH_BATCH_SIZE", 10))
+publish_lease_seconds = int(os.getenv("PUBLISH_LEASE_SECONDS", 120))
+publish_max_attempts = int(os.getenv("PUBLISH_MAX_ATTEMPTS", 5))
+publish_retry_base_seconds = int(os.getenv("PUBLISH_RETRY_BASE_SECONDS", 5))
+
+users_cache = TTLCache(
+    max_size=int(os.getenv("USERS_CACHE_SIZE", 10000)),
+    ttl=int(os.getenv("USERS_CACHE_TTL", 300)),
+)
+admins_cache = TTLCache(max_size=1, ttl=int(os.getenv("ADMINS_CACHE_TTL", 60)))
+admins_cache_key = "admins"
+last_login_buffer = {}
+
+create_ad_statement = text("""
+    WITH author AS (
+        SELECT id, telegram_login FROM public.users
+        WHERE telegram_id = CAST(:telegram_id AS BIGINT)
+    ), new_ad AS (
+        INSERT INTO public.ads (
+            user_id, title, description, cost, category_id,
+            is_valid, is_rejected, is_published, created_at
+        )
+        SELECT
+            author.id,
+            CAST(:title AS VARCHAR),
+            CAST(:description AS VARCHAR),
+            CAST(:cost AS INTEGER),
+            CAST(:category_id AS INTEGER),
+            false, false, false,
+            CAST(:now AS TIMESTAMP)
+        FROM author
+        RETURNING id, title, description, cost
+    ), new_images AS (
+        INSERT INTO public.images (image_id, media_id, ad_id)
+        SELECT image.image_id, CAST(:media_id AS VARCHAR), new_ad.id
+        FROM new_ad,
+            unnest(CAST(:image_ids AS VARCHAR[])) WITH ORDINALITY
+            AS image (image_id, position)
+        ORDER BY image.position
+    )
+    SELECT new_ad.id, new_ad.title, new_ad.description, new_ad.cost,
+        author.telegram_login
+    FROM new_ad, author
+    """)
+
+approve_ad_statement = text("""
+    WITH approved AS (
+        UPDATE public.ads SET is_valid = true
+        WHERE id = CAST(:ad_id AS INTEGER) AND is_published IS false
+        RETURNING id
+    )
+    INSERT INTO public.publish_jobs (
+        ad_id, status, attempts, next_attempt_at, created_at
+    )
+    SELECT id, 'pending', 0, CAST(:now AS TIMESTAMP), CAST(:now AS TIMESTAMP)
+    FROM approved
+    ON CONFLICT (ad_id) DO UPDATE
+    SET status = 'pending', attempts = 0, next_attempt_at = excluded.next_attempt_at,
+        locked_until = NULL, last_error = NULL
+    WHERE publish_jobs.status <> 'pending'
+    RETURNING id
+    """)
+
+expire_ads_statement = text("""
+    WITH expired AS (
+        SELECT id FROM public.ads
+        WHERE COALESCE(published_at, created_at) < CAST(:cutoff AS TIMESTAMP)
+        ORDER BY COALESCE(published_at, created_at), id
+        LIMIT CAST(:batch_size AS INTEGER)
+        FOR UPDATE SKIP LOCKED
+    ), removed_messages AS (
+        DELETE FROM public.message_ids USING expired
+        WHERE message_ids.ad_id = expired.id
+        RETURNING message_ids.message_id
+    ), removed_images AS (
+        DELETE FROM public.images USING expired
+        WHERE images.ad_id = expired.id
+        RETURNING images.id, images.ad_id, images.image_id, images.media_id
+    ), removed_jobs AS (
+        DELETE FROM public.publish_jobs USING expired
+        WHERE publish_jobs.ad_id = expired.id
+    ), removed_ads AS (
+        DELETE FROM public.ads USING expired
+        WHERE ads.id = expired.id
+        RETURNING ads.*
+    ), archived AS (
+        INSERT INTO public.ads_archive (
+            id, title, description, cost, is_valid, is_rejected, is_published,
+            user_id, category_id, media_id, image_ids, created_at, published_at,
+            archived_at
+        )
+        SELECT
+            removed_ads.id, removed_ads.title, removed_ads.description,
+            removed_ads.cost, removed_ads.is_valid, removed_ads.is_rejected,
+            removed_ads.is_published, removed_ads.user_id,
+            removed_ads.category_id,
+            (SELECT max(removed_images.media_id) FROM removed_images
+                WHERE removed_images.ad_id = removed_ads.id),
+            (SELECT array_agg(removed_images.image_id ORDER BY removed_images.id)
+                FROM removed_images
+                WHERE removed_images.ad_id = removed_ads.id),
+            removed_ads.created_at,
+            removed_ads.published_at,
+            CAST(:now AS TIMESTAMP)
+        FROM removed_ads
+        ON CONFLICT (id) DO UPDATE
+        SET title = excluded.title, description = excluded.description,
+            cost = excluded.cost, is_valid = excluded.is_valid,
+            is_rejected = excluded.is_rejected,
+            is_published = excluded.is_published, user_id = excluded.user_id,
+            category_id = excluded.category_id, media_id = excluded.media_id,
+            image_ids = excluded.image_ids, created_at = excluded.created_at,
+            published_at = excluded.published_at,
+            archived_at = excluded.archived_at
+        RETURNING id
+    )
+    SELECT
+        (SELECT count(*) FROM removed_ads) AS archived,
+        ARRAY(SELECT message_id FROM removed_messages) AS message_ids
+    """)
 
 
 async def create_or_update_user(request: CreateUserRequest):
-    async with async_session() as session:
+    user = users_cache.get(request.telegram_id)
+    if user is not None and (
+        user.first_name,
+        user.last_name,
+        user.telegram_login,
+    ) == (request.first_name, request.last_name, request.telegram_login):
+        touch_last_login(request.telegram_id)
+        return user
+    now = datetime.now()
+    statement = insert_or_update(User).values(
+        first_name=request.first_name,
+        last_name=request.last_name,
+        telegram_id=request.telegram_id,
+        telegram_login=request.telegram_login,
+        register_date=now,
+        last_login=now,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={
+            "first_name": statement.excluded.first_name,
+            "last_name": statement.excluded.last_name,
+            "telegram_login": statement.excluded.telegram_login,
+            "last_login": statement.excluded.last_login,
+        },
+    ).returning(User)
+    async with write_session() as session:
         async with session.begin():
-            result = await session.execute(
-                select(User).where(User.telegram_id == request.telegram_id)
+            user = await session.scalar(
+                statement, execution_options={"populate_existing": True}
             )
-            user = result.scalar_one_or_none()
-            if user is None:
+    after_commit(lambda: users_cache.set(request.telegram_id, user))
+    return user
+
+
+def touch_last_login(user_telegram_id):
+    last_login_buffer[user_telegram_id] = datetime.now()
+
+
+async def flush_last_logins():
+    if not last_login_buffer:
+        return 0
+    pending = dict(last_login_buffer)
+    last_login_buffer.clear()
+    try:
+        async with write_session() as session:
+            async with session.begin():
                 await session.execute(
-                    insert(User),
-                    [
-                        {
-                            "first_name": request.first_name,
-                            "last_name": request.last_name,
-                            "telegram_id": request.telegram_id,
-                            "telegram_login": request.telegram_login,
-                        }
-                    ],
+                    text(
+                        "UPDATE public.users SET last_login = pending.last_login "
+                        "FROM unnest(CAST(:telegram_ids AS BIGINT[]), "
+                        "CAST(:last_logins AS TIMESTAMP[])) "
+                        "AS pending (telegram_id, last_login) "
+                        "WHERE users.telegram_id = pending.telegram_id"
+                    ),
+                    {
+                        "telegram_ids": list(pending.keys()),
+                        "last_logins": list(pending.values()),
+                    },
                 )
-                return user
-            else:
-                user.last_login = datetime.now()
-                return user
+    except Exception:
+        for user_telegram_id, last_login in pending.items():
+            last_login_buffer.setdefault(user_telegram_id, last_login)
+        raise
+    return len(pending)
 
 
 async def check_user_phone_is_none(user_telegram_id):
-    async with async_session() as session:
+    user = await fetch_user_by_id(user_telegram_id)
+    return user.phone is None
+
+
+async def add_phone_to_user(phone, user_telegram_id):
+    async with write_session() as session:
         async with session.begin():
-            result = await session.execute(
-                select(User).where(User.telegram_id == user_telegram_id)
+            await session.execute(
+                update(User)
+                .where(User.telegram_id == user_telegram_id)
+                .values(phone=phone)
             )
-            user = result.scalar_one()
-            return user.phone is None
+    invalidate_user(user_telegram_id)
 
 
-async def add_phone_to_user(phone, user_telegram_id):
-    async with async_session() as session:
+async def set_user_is_admin(user_telegram_id, is_admin: bool):
+    async with write_session() as session:
         async with session.begin():
-            result = await session.execute(
-                select(User).where(User.telegram_id == user_telegram_id)
+            await session.execute(
+                update(User)
+                .where(User.telegram_id == user_telegram_id)
+                .values(is_admin=is_admin)
             )
-            user = result.scalar_one()
-            user.phone = phone
+    invalidate_user(user_telegram_id)
 
 
-async def create_ad(request: CreateAdRequest):
-    async with async_session() as session:
+async def set_user_is_blocked(user_telegram_id, is_blocked: bool):
+    async with write_session() as session:
         async with session.begin():
-            select_user_result = await session.execute(
-                select(User).where(User.telegram_id == request.user_id)
+            await session.execute(
+                update(User)
+                .where(User.telegram_id == user_telegram_id)
+                .values(is_blocked=is_blocked)
             )
-            user = select_user_result.scalar_one()
-            ad: Ad = await session.scalar(
-                insert(Ad).returning(Ad),
-                [
-                    {
-                        "user_id": user.id,
-                        "title": request.title,
-                        "description": request.description,
-                        "cost": int(request.cost),
-                        "category_id": request.category_id,
-                    }
-                ],
+    invalidate_user(user_telegram_id)
+
+
+def invalidate_user(user_telegram_id):
+    def invalidate():
+        users_cache.invalidate(user_telegram_id)
+        admins_cache.clear()
+
+    invalidate()
+    after_commit(invalidate)
+
+
+def users_cache_stats():
+    return {"users": users_cache.stats(), "admins": admins_cache.stats()}
+
+
+def cache_samples():
+    for cache, stats in users_cache_stats().items():
+        labels = (("cache", cache),)
+        yield "cache_hits_total", "counter", "cache_hits_total", labels, stats["hits"]
+        yield (
+            "cache_misses_total",
+            "counter",
+            "cache_misses_total",
+            labels,
+            stats["misses"],
+        )
+        yield "cache_size", "gauge", "cache_size", labels, stats["size"]
+
+
+async def create_ad(request: CreateAdRequest):
+    async with write_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                create_ad_statement,
+                {
+                    "telegram_id": request.user_id,
+                    "title": request.title,
+                    "description": request.description,
+                    "cost": int(request.cost),
+                    "category_id": request.category_id,
+                    "media_id": request.media_id,
+                    "image_ids": list(request.image_ids or []),
+                    "now": datetime.now(),
+                },
             )
-            if request.media_id is not None:
-                await session.execute(
-                    update(Image)
-                    .where(Image.media_id == request.media_id)
-                    .values(ad_id=ad.id)
-                )
-            if request.file_id is not None:
-                await session.execute(
-                    update(Image)
-                    .where(Image.image_id == request.file_id)
-                    .values(ad_id=ad.id)
-                )
+            ad = result.one()
             return AdResponse(
                 ad_id=ad.id,
                 title=ad.title,
-                user_telegram=user.telegram_login,
+                user_telegram=ad.telegram_login,
                 description=ad.description,
                 cost=ad.cost,
                 category=request.category_title,
-                image_ids=[],
+                image_ids=list(request.image_ids or []),
             )
 
 
-async def fetch_category_by_alias(alias):
-    async with async_session() as session:
+async def fetch_categories():
+    async with read_session() as session:
         async with session.begin():
-            select_category_result = await session.execute(
-                select(AdCategory).where(AdCategory.alias == alias)
-            )
-            category = select_category_result.scalar_one()
-            return category
+            result = await session.execute(select(AdCategory).order_by(AdCategory.id))
+            return [
+                Category(id=category.id, title=category.title, alias=category.alias)
+                for category in result.scalars().all()
+            ]
 
 
 async def fetch_user_by_id(user_id):
-    async with async_session() as session:
+    user = users_cache.get(user_id)
+    if user is not None:
+        return user
+    async with primary_session() as session:
         async with session.begin():
             user_result = await session.execute(
                 select(User).where(User.telegram_id == user_id)
             )
             user = user_result.scalar_one()
-            return user
+    after_commit(lambda: users_cache.set(user_id, user))
+    return user
 
 
-async def fetch_ads_by_user(user_id):
-    async with async_session() as session:
+async def fetch_ads_by_user(user_id, after_id=None, before_id=None):
+    async with read_session(user_id) as session:
         async with session.begin():
-            all_ads = []
-            result = await session.execute(
-                select(Ad)
+            query = (
+                select_ad_responses()
                 .where(Ad.is_published)
-                .filter(User.telegram_id == user_id)
-                .join(User)
-            )
-            ads_result = result.scalars().unique().all()
-            count = 0
-            for index, ad in enumerate(ads_result):
-                ad_response = AdResponse(
-                    ad.id,
-                    ad.title,
-                    ad.user.telegram_login,
-                    ad.description,
-                    ad.cost,
-                    ad.category.title,
-                    [image.image_id for image in ad.images],
-                )
-                all_ads.append(ad_response)
-                count = index + 1
-            return (
-                True if count > 0 else False,
-                all_ads if count > 0 else "Нет объявлений",
+                .where(User.telegram_id == user_id)
+                .limit(ads_page_size + 1)
+            )
+            if before_id is not None:
+                query = query.where(Ad.id < int(before_id)).order_by(Ad.id.desc())
+            else:
+                if after_id is not None:
+                    query = query.where(Ad.id > int(after_id))
+                query = query.order_by(Ad.id)
+            result = await session.execute(query)
+            all_ads = [to_ad_response(row) for row in result]
+            has_more = len(all_ads) > ads_page_size
+            all_ads = all_ads[:ads_page_size]
+            if before_id is not None:
+                all_ads.reverse()
+                has_previous, has_next = has_more, True
+            else:
+                has_previous, has_next = after_id is not None, has_more
+            return AdsPage(
+                ads=all_ads,
+                previous_before_id=(
+                    all_ads[0].ad_id if all_ads and has_previous else None
+                ),
+                next_after_id=all_ads[-1].ad_id if all_ads and has_next else None,
             )
 
 
-async def fetch_ads_to_validate():
-    async with async_session() as session:
+async def search_ads(search: SearchQuery, offset=0):
+    query = (
+        select_ad_responses()
+        .where(Ad.is_published)
+        .offset(offset)
+        .limit(search_page_size + 1)
+    )
+    if search.terms:
+        ts_query = func.to_tsquery(
+            search_config, " & ".join(f"{term}:*" for term in search.terms)
+        )
+        query = query.where(Ad.search_vector.op("@@")(ts_query)).order_by(
+            func.ts_rank_cd(Ad.search_vector, ts_query).desc(), Ad.id.desc()
+        )
+    else:
+        query = query.order_by(Ad.id.desc())
+    if search.category_id is not None:
+        query = query.where(Ad.category_id == search.category_id)
+    if search.min_cost is not None:
+        query = query.where(Ad.cost >= search.min_cost)
+    if search.max_cost is not None:
+        query = query.where(Ad.cost <= search.max_cost)
+    try:
+        async with read_session() as session:
+            async with session.begin():
+                await session.execute(
+                    text("SELECT set_config('statement_timeout', :timeout, true)"),
+                    {"timeout": str(search_statement_timeout_ms)},
+                )
+                result = await session.execute(query)
+                ads = [to_ad_response(row) for row in result]
+    except DBAPIError as error:
+        logging.warning("Поиск объявлений прерван: %s", error)
+        return SearchPage(ads=[], next_offset=None)
+    return SearchPage(
+        ads=ads[:search_page_size],
+        next_offset=offset + search_page_size if len(ads) > search_page_size else None,
+    )
+
+
+async def fetch_ads_to_validate(moderator_telegram_id):
+    async with write_session() as session:
         async with session.begin():
-            all_ads = []
-            result = await session.execute(
-                select(Ad)
+            now = datetime.now()
+            claimable = (
+                select(Ad.id)
                 .where(Ad.is_valid.is_(False))
                 .where(Ad.is_rejected.is_(False))
+                .where(or_(Ad.claimed_until.is_(None), Ad.claimed_until < now))
+                .order_by(Ad.id)
+                .limit(moderation_batch_size)
+                .with_for_update(skip_locked=True)
             )
-            ads_result = result.scalars().unique().all()
-            if ads_result:
-                for ad in ads_result:
-                    ad_response = AdResponse(
-                        ad.id,
-                        ad.title,
-                        ad.user.telegram_login,
-                        ad.description,
-                        ad.cost,
-                        ad.category.title,
-                        [image.image_id for image in ad.images],
-                    )
-                    all_ads.append(ad_response)
-            return all_ads
+            claim_result = await session.execute(
+                update(Ad)
+                .where(Ad.id.in_(claimable))
+                .values(
+                    claimed_by=moderator_telegram_id,
+                    claimed_until=now + timedelta(seconds=moderation_lease_seconds),
+                )
+                .returning(Ad.id)
+                .execution_options(synchronize_session=False)
+            )
+            ad_ids = claim_result.scalars().all()
+            if not ad_ids:
+                return []
+            result = await session.execute(
+                select_ad_responses().where(Ad.id.in_(ad_ids)).order_by(Ad.id)
+            )
+            return [to_ad_response(row) for row in result]
+
+
+async def unpublish_ads(ad_ids=None, user_telegram_id=None):
+    conditions = []
+    if ad_ids is not None:
+        conditions.append(Ad.id.in_([int(ad_id) for ad_id in ad_ids]))
+    if user_telegram_id is not None:
+        conditions.append(
+            Ad.user_id
+            == select(User.id)
+            .where(User.telegram_id == int(user_telegram_id))
+            .scalar_subquery()
+        )
+    unpublished = (
+        update(Ad)
+        .where(Ad.is_published.is_(True))
+        .where(*conditions)
+        .values(is_published=False)
+        .returning(Ad.id)
+        .cte("unpublished")
+    )
+    deleted = (
+        delete(MessageId)
+        .where(MessageId.ad_id == unpublished.c.id)
+        .returning(MessageId.message_id)
+        .cte("deleted")
+    )
+    cancelled = (
+        update(PublishJob)
+        .where(PublishJob.status == "pending")
+        .where(PublishJob.ad_id.in_(select(Ad.id).where(*conditions)))
+        .values(status="cancelled", locked_until=None)
+        .returning(PublishJob.id)
+        .cte("cancelled")
+    )
+    statement = select(
+        select(
+            func.coalesce(func.array_agg(deleted.c.message_id), literal_column("'{}'"))
+        )
+        .scalar_subquery()
+        .label("message_ids"),
+        select(func.count())
+        .select_from(cancelled)
+        .scalar_subquery()
+        .label("cancelled"),
+    )
+    async with write_session() as session:
+        async with session.begin():
+            result = await session.execute(statement)
+            return result.one()
 
 
-async def unpublished_ad(ad_id):
-    async with async_session() as session:
+async def expire_ads():
+    now = datetime.now()
+    async with write_session() as session:
         async with session.begin():
             result = await session.execute(
-                select(Ad).options(joinedload(Ad.images)).where(Ad.id == int(ad_id))
+                expire_ads_statement,
+                {
+                    "cutoff": now - timedelta(days=ad_ttl_days),
+                    "batch_size": ad_expiry_batch_size,
+                    "now": now,
+                },
             )
-            ad = result.scalars().unique().all()
-            first_ad = ad[0]
-            first_ad.is_published = False
-            await session.commit()
-            return first_ad
+            return result.one()
 
 
 async def reject_ad(ad_id):
-    async with async_session() as session:
+    async with write_session() as session:
         async with session.begin():
             await session.execute(
                 update(Ad).where(Ad.id == int(ad_id)).values(is_rejected=True)
@@ -192,39 +525,161 @@ async def reject_ad(ad_id):
 
 
 async def fetch_ad_by_id(ad_id: str):
-    async with async_session() as session:
+    async with primary_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                select_ad_details().where(Ad.id == int(ad_id))
+            )
+            row = result.one_or_none()
+            return to_ad_details(row) if row else None
+
+
+async def approve_ad(ad_id):
+    async with write_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                approve_ad_statement, {"ad_id": int(ad_id), "now": datetime.now()}
+            )
+            return result.scalar_one_or_none() is not None
+
+
+async def claim_publish_jobs():
+    async with write_session() as session:
         async with session.begin():
-            result = await session.execute(select(Ad).where(Ad.id == int(ad_id)))
-            ad = result.scalars().unique().all()
-            return ad
+            now = datetime.now()
+            claimable = (
+                select(PublishJob.id)
+                .where(PublishJob.status == "pending")
+                .where(PublishJob.next_attempt_at <= now)
+                .where(
+                    or_(
+                        PublishJob.locked_until.is_(None),
+                        PublishJob.locked_until < now,
+                    )
+                )
+                .order_by(PublishJob.id)
+                .limit(publish_batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            claim_result = await session.execute(
+                update(PublishJob)
+                .where(PublishJob.id.in_(claimable))
+                .values(
+                    locked_until=now + timedelta(seconds=publish_lease_seconds),
+                    attempts=PublishJob.attempts + 1,
+                )
+                .returning(
+                    PublishJob.id,
+                    PublishJob.ad_id,
+                    PublishJob.attempts,
+                    PublishJob.locked_until,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            jobs = claim_result.all()
+            if not jobs:
+                return []
+            result = await session.execute(
+                select_ad_details().where(Ad.id.in_([job.ad_id for job in jobs]))
+            )
+            ads = {ad.ad_id: ad for ad in map(to_ad_details, result)}
+            return [
+                PublishTask(
+                    job_id=job.id,
+                    attempts=job.attempts,
+                    locked_until=job.locked_until,
+                    ad=ads[job.ad_id],
+                )
+                for job in sorted(jobs, key=lambda job: job.id)
+                if job.ad_id in ads
+            ]
+
+
+async def renew_publish_lease(task: PublishTask):
+    async with write_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                update(PublishJob)
+                .where(PublishJob.id == task.job_id)
+                .where(PublishJob.status == "pending")
+                .where(PublishJob.locked_until == task.locked_until)
+                .values(
+                    locked_until=datetime.now()
+                    + timedelta(seconds=publish_lease_seconds)
+                )
+                .returning(PublishJob.locked_until)
+                .execution_options(synchronize_session=False)
+            )
+            locked_until = result.scalar_one_or_none()
+    if locked_until is None:
+        return False
+    task.locked_until = locked_until
+    return True
 
 
-async def set_publish_ad_id(ids):
-    async with async_session() as session:
+async def complete_publish_job(task: PublishTask, message_ids):
+    now = datetime.now()
+    async with write_session() as session:
         async with session.begin():
-            await session.execute(insert(MessageId), ids)
+            result = await session.execute(
+                update(PublishJob)
+                .where(PublishJob.id == task.job_id)
+                .where(PublishJob.status == "pending")
+                .where(PublishJob.locked_until == task.locked_until)
+                .values(status="done", published_at=now, locked_until=None)
+                .returning(PublishJob.id)
+                .execution_options(synchronize_session=False)
+            )
+            if result.scalar_one_or_none() is None:
+                return False
+            ad_id = task.ad.ad_id
+            await session.execute(
+                insert(MessageId),
+                [
+                    {"message_id": int(message_id), "ad_id": int(ad_id)}
+                    for message_id in message_ids
+                ],
+            )
             await session.execute(
                 update(Ad)
-                .where(Ad.id == ids[0]["ad_id"])
-                .values(is_published=True)
-                .values(is_valid=True)
+                .where(Ad.id == int(ad_id))
+                .values(is_published=True, is_valid=True, published_at=now)
             )
+    return True
 
 
-async def save_photo_id_from_media_group(image_id: str, media_id=None):
-    async with async_session() as session:
+async def fail_publish_job(task: PublishTask, error):
+    values = {"locked_until": None, "last_error": str(error)[:1000]}
+    if task.attempts >= publish_max_attempts:
+        values["status"] = "failed"
+    else:
+        values["next_attempt_at"] = datetime.now() + timedelta(
+            seconds=publish_retry_base_seconds * 2 ** (task.attempts - 1)
+        )
+    async with write_session() as session:
         async with session.begin():
-            await session.scalar(
-                insert(Image),
-                [{"image_id": image_id or None, "media_id": media_id or None}],
+            await session.execute(
+                update(PublishJob)
+                .where(PublishJob.id == task.job_id)
+                .where(PublishJob.status == "pending")
+                .where(PublishJob.locked_until == task.locked_until)
+                .values(**values)
             )
 
 
 async def fetch_all_admins():
-    async with async_session() as session:
+    users = admins_cache.get(admins_cache_key)
+    if users is not None:
+        return users
+    async with read_session() as session:
         async with session.begin():
             result = await session.execute(
                 select(User).where(User.is_admin).where(User.is_blocked.is_(False))
             )
             users = result.scalars().all()
-            return users
+    after_commit(lambda: admins_cache.set(admins_cache_key, users))
+    return users
+
+
+metrics.add_collector(cache_samples)
+metrics.instrument_module(globals(), "db_service", "function")
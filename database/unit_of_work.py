@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+import logging
+import os
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from database.db_config import async_session, engine
+from metrics import metrics
+
+unit_of_work_enabled = os.getenv("UNIT_OF_WORK", "1") == "1"
+per_update_buckets = (0, 1, 2, 3, 4, 6, 8, 12)
+
+current_unit = ContextVar("unit_of_work", default=None)
+
+
+class UnitOfWork:
+    def __init__(self, factory):
+        self.factory = factory
+        self.task = asyncio.current_task()
+        self.session = None
+        self.closed = False
+        self.failed = False
+        self.callbacks = []
+        self.checkouts = 0
+        self.commits = 0
+
+    def owns(self):
+        return not self.closed and self.task is asyncio.current_task()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        if self.session is None:
+            self.session = self.factory()
+        checkpoint = len(self.callbacks)
+        savepoint = None
+        if self.session.in_transaction():
+            savepoint = await self.session.begin_nested()
+        try:
+            yield SharedSession(self.session)
+        except BaseException:
+            del self.callbacks[checkpoint:]
+            if savepoint is None:
+                await self.session.rollback()
+            else:
+                try:
+                    await savepoint.rollback()
+                except Exception:
+                    self.failed = True
+                    self.callbacks.clear()
+                    await self.session.rollback()
+            raise
+        if savepoint is not None:
+            await savepoint.commit()
+
+    async def commit(self):
+        callbacks, self.callbacks = self.callbacks, []
+        failed, self.failed = self.failed, False
+        if self.session is not None and self.session.in_transaction():
+            if failed:
+                logging.warning("Транзакция обновления отменена после ошибки")
+                await self.session.rollback()
+                return
+            await self.session.commit()
+        for callback in callbacks:
+            callback()
+
+
+class SharedSession:
+    __slots__ = ("session",)
+
+    def __init__(self, session):
+        self.session = session
+
+    def begin(self):
+        return contextlib.nullcontext(self.session)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+def primary_session():
+    unit = current_unit.get()
+    if unit is not None and unit.owns():
+        return unit.transaction()
+    return async_session()
+
+
+async def commit_current():
+    unit = current_unit.get()
+    if unit is not None and unit.owns():
+        await unit.commit()
+
+
+def after_commit(callback):
+    unit = current_unit.get()
+    if unit is not None and unit.owns():
+        unit.callbacks.append(callback)
+    else:
+        callback()
+
+
+@contextlib.asynccontextmanager
+async def unit_of_work(name):
+    unit = UnitOfWork(async_session)
+    unit.closed = not unit_of_work_enabled
+    token = current_unit.set(unit)
+    try:
+        yield unit
+        unit.closed = True
+        await unit.commit()
+    finally:
+        unit.closed = True
+        current_unit.reset(token)
+        if unit.session is not None:
+            await unit.session.close()
+        labels = (("update", name),)
+        metrics.observe(
+            "db_checkouts_per_update", labels, unit.checkouts, per_update_buckets
+        )
+        metrics.observe(
+            "db_commits_per_update", labels, unit.commits, per_update_buckets
+        )
+
+
+def track_engine(tracked_engine):
+    def checkout(connection, record, proxy):
+        unit = current_unit.get()
+        if unit is not None:
+            unit.checkouts += 1
+
+    def commit(connection):
+        unit = current_unit.get()
+        if unit is not None:
+            unit.commits += 1
+
+    event.listen(tracked_engine.sync_engine.pool, "checkout", checkout)
+    event.listen(tracked_engine.sync_engine, "commit", commit)
+
+
+track_engine(engine)
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import os
 
@@ -6,7 +5,8 @@ from telegram.ext import (
     Application,
     ApplicationBuilder,
     CommandHandler,
-    CallbackQueryHandler,
+    ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
     filters,
 )
@@ -15,59 +15,165 @@ from bot.ads_conversation import conversation_handler, conversation_publish
 from bot.handlers import (
     start_handler,
     view_ads_handler,
+    view_previous_ads_handler,
     add_phone_to_user_handler,
     validate_ad_handler,
+    disapprove_ad_handler,
     reject_ad_handler,
     delete_ad_handler,
     validate_ads_handler,
+    reload_categories_handler,
+    profiler_handler,
+    unpublish_all_ads_handler,
+    takedown_handler,
+    refresh_categories_job,
+    flush_last_logins_job,
+    check_replicas_job,
 )
-from bot.keyboards import (
-    view_ad_callback,
-    validation_ad_callback,
-    return_to_start_callback,
-    publish_ad_callback,
+from bot.application import BotApplication
+from bot.callback_data import Action, CallbackRouter
+from bot.inline_search import inline_search_handler
+from bot.publisher import (
+    publish_outbox_job,
+    publish_outbox_interval,
+    expire_ads_job,
+    ad_expiry_interval,
 )
-from database.db_config import database_init
+from bot.rate_limiter import PriorityRateLimiter, outbound_global_rate
+from bot.startup import startup
+from bot.workers import run_cluster, run_single
+from database.categories import category_registry
+from database.persistence import DatabasePersistence
+from database.routing import replica_health_interval, session_router
+from database.services import flush_last_logins, fetch_all_admins
+from metrics import metrics
 
 token = os.getenv("BOT_TOKEN")
+categories_refresh_interval = int(os.getenv("CATEGORIES_REFRESH_INTERVAL", 3600))
+last_login_flush_interval = int(os.getenv("LAST_LOGIN_FLUSH_INTERVAL", 5))
+webhook_workers = int(os.getenv("WEBHOOK_WORKERS", 1))
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 
 
+callback_router = CallbackRouter()
+callback_router.route(Action.START, start_handler)
+callback_router.route(Action.VIEW_ADS, view_ads_handler)
+callback_router.route(Action.ADS_NEXT, view_ads_handler)
+callback_router.route(Action.ADS_PREV, view_previous_ads_handler)
+callback_router.route(Action.MODERATION_QUEUE, validate_ads_handler)
+callback_router.route(Action.APPROVE_AD, validate_ad_handler)
+callback_router.route(Action.DISAPPROVE_AD, disapprove_ad_handler)
+callback_router.route(Action.UNPUBLISH_AD, delete_ad_handler)
+callback_router.route(Action.UNPUBLISH_ALL, unpublish_all_ads_handler)
+callback_router.route(Action.PUBLISH_AD, conversation_publish)
+
+
 def handlers_register(application: Application):
     application.add_handler(conversation_handler())
     application.add_handler(CommandHandler("start", start_handler))
     application.add_handler(
-        CallbackQueryHandler(start_handler, pattern=return_to_start_callback)
-    )
-    application.add_handler(
-        CallbackQueryHandler(view_ads_handler, pattern=view_ad_callback)
+        CommandHandler("reload_categories", reload_categories_handler)
     )
-    application.add_handler(
-        CallbackQueryHandler(validate_ads_handler, pattern=validation_ad_callback)
-    )
-    application.add_handler(
-        CallbackQueryHandler(validate_ad_handler, pattern=r"approve_ad_\d+")
+    application.add_handler(CommandHandler("takedown", takedown_handler))
+    application.add_handler(CommandHandler("profiler", profiler_handler))
+    application.add_handler(callback_router.handler())
+    application.add_handler(InlineQueryHandler(inline_search_handler))
+    application.add_handler(MessageHandler(filters.TEXT, reject_ad_handler))
+    application.add_handler(MessageHandler(filters.CONTACT, add_phone_to_user_handler))
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+
+
+def instrument_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            handler.callback = metrics.timed(
+                "bot_handler", "handler", handler.callback.__name__, handler.callback
+            )
+
+
+async def post_init(application: Application):
+    async with startup.step("categories"):
+        await category_registry.load()
+    async with startup.step("admins"):
+        await fetch_all_admins()
+    async with startup.step("replicas"):
+        await session_router.check_replicas()
+    await startup.warm_up()
+    application.job_queue.run_repeating(
+        refresh_categories_job,
+        interval=categories_refresh_interval,
+        first=categories_refresh_interval,
     )
-    application.add_handler(
-        CallbackQueryHandler(validate_ad_handler, pattern=r"disapprove_ad_\d+")
+    application.job_queue.run_repeating(
+        flush_last_logins_job, interval=last_login_flush_interval
     )
-    application.add_handler(
-        CallbackQueryHandler(delete_ad_handler, pattern=r"delete_ad_\d+")
+    application.job_queue.run_repeating(
+        publish_outbox_job, interval=publish_outbox_interval
     )
-    application.add_handler(
-        CallbackQueryHandler(conversation_publish, pattern=publish_ad_callback)
+    application.job_queue.run_repeating(expire_ads_job, interval=ad_expiry_interval)
+    if session_router.replicas:
+        application.job_queue.run_repeating(
+            check_replicas_job,
+            interval=replica_health_interval,
+            first=replica_health_interval,
+        )
+    startup.finish()
+
+
+async def post_shutdown(application: Application):
+    await flush_last_logins()
+    await session_router.dispose()
+
+
+def application_builder():
+    return (
+        ApplicationBuilder()
+        .application_class(BotApplication)
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(DatabasePersistence())
+        .rate_limiter(
+            PriorityRateLimiter(
+                global_rate=outbound_global_rate / webhook_workers,
+                shared_chats=[
+                    channel for channel in (os.getenv("TARGET_CHANNEL"),) if channel
+                ],
+                workers=webhook_workers,
+            )
+        )
     )
-    application.add_handler(MessageHandler(filters.TEXT, reject_ad_handler))
-    application.add_handler(MessageHandler(filters.CONTACT, add_phone_to_user_handler))
 
 
-def main():
-    application = ApplicationBuilder().token(token).build()
+def build_application():
+    application = application_builder().build()
     handlers_register(application)
-    application.run_webhook(
+    return application
+
+
+def main():
+    if webhook_workers > 1:
+        run_cluster(
+            build_application,
+            workers=webhook_workers,
+            token=token,
+            listen="0.0.0.0",
+            port=int(os.getenv("PORT")),
+            url_path=os.getenv("URL_PATH"),
+            webhook_url=os.getenv("WEBHOOK_PATH"),
+        )
+        return
+    run_single(
+        build_application,
         listen="0.0.0.0",
         port=int(os.getenv("PORT")),
         url_path=os.getenv("URL_PATH"),
@@ -76,6 +182,4 @@ def main():
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(database_init())
     main()
@@ -0,0 +1,120 @@
+import inspect
+import os
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+metrics_push_interval = float(os.getenv("METRICS_PUSH_INTERVAL", 5))
+
+
+class Histogram:
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def samples(self, name, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield name, "histogram", f"{name}_bucket", labels + (("le", bound),), count
+        infinity = labels + (("le", "+Inf"),)
+        yield name, "histogram", f"{name}_bucket", infinity, self.count
+        yield name, "histogram", f"{name}_sum", labels, self.sum
+        yield name, "histogram", f"{name}_count", labels, self.count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self.gauges = Counter()
+        self.collectors = []
+
+    def observe(self, name, labels, value, buckets=latency_buckets):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram(buckets)
+        histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        self.counters[(name, labels)] += amount
+
+    def gauge_add(self, name, labels, amount):
+        self.gauges[(name, labels)] += amount
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def samples(self):
+        for (name, labels), histogram in self.histograms.items():
+            yield from histogram.samples(name, labels)
+        for (name, labels), value in self.counters.items():
+            yield name, "counter", name, labels, value
+        for (name, labels), value in self.gauges.items():
+            yield name, "gauge", name, labels, value
+        for collector in self.collectors:
+            yield from collector()
+
+    def timed(self, subsystem, label, name, function):
+        labels = ((label, name),)
+
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            self.gauge_add(f"{subsystem}_in_flight", labels, 1)
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                self.inc(f"{subsystem}_errors_total", labels)
+                raise
+            finally:
+                self.observe(
+                    f"{subsystem}_duration_seconds",
+                    labels,
+                    time.perf_counter() - started,
+                )
+                self.gauge_add(f"{subsystem}_in_flight", labels, -1)
+
+        return wrapper
+
+    def instrument_module(self, namespace, subsystem, label):
+        for name, function in list(namespace.items()):
+            if (
+                inspect.iscoroutinefunction(function)
+                and function.__module__ == namespace["__name__"]
+            ):
+                namespace[name] = self.timed(subsystem, label, name, function)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render(samples):
+    families = defaultdict(list)
+    kinds = {}
+    for family, kind, name, labels, value in samples:
+        kinds[family] = kind
+        families[family].append(f"{name}{format_labels(labels)} {value}")
+    lines = []
+    for family, family_lines in families.items():
+        lines.append(f"# TYPE {family} {kinds[family]}")
+        lines.extend(family_lines)
+    return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()